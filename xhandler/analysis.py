@@ -1,20 +1,45 @@
 import numpy as np
 from base import Spectrum, Peak
 from maths import Gaussian
+from fitting import MultipletFitter, FitResult
+from preprocess import zero_run_cutoff
+from peaksearch import PeakSearch, match_to_theory
+from calibration import CalibrationResult, auto_calibrate
 from physics import Reaction
 
 
 class PeakSupervisor:
-    def __init__(self, x_data: np.ndarray, y_data: np.ndarray, center: float, fwhm: float) -> None:
+    def __init__(self, x_data: np.ndarray, y_data: np.ndarray, center: float, fwhm: float,
+                 area: float = None, state: float = None, errors: tuple[float, float, float] = None) -> None:
+        '''
+        When area is given (e.g. from multiplet fit) it is taken as is,
+        otherwise it is estimated by projection onto fixed gaussian.
+        State is excitation energy of residual nuclei assigned to peak.
+        Errors are standard deviations of (mu, fwhm, area) from the fit.
+        '''
         self.x_data = x_data
         self.y_data = y_data
+        self.state = state
 
         self.mu = center
-        self.mu_index = np.abs(np.subtract(x_data, center)).argmin()
+        self.mu_index = PeakSupervisor.nearest_index(x_data, center)
 
         self.fwhm = fwhm
         self.peak = Peak()
-        self.lorentzian = self.approximate()
+        self.lorentzian = self.approximate() if area is None else self.__settle(area)
+        if errors is not None:
+            self.peak.update_errors(*errors)
+
+    @staticmethod
+    def nearest_index(x_data: np.ndarray, value: float) -> int:
+        index = int(np.searchsorted(x_data, value))
+        if index > 0 and (index == len(x_data) or value - x_data[index - 1] <= x_data[index] - value):
+            index -= 1
+        return index
+
+    def __settle(self, area: float) -> Gaussian:
+        self.__save_params(self.mu, self.fwhm, area)
+        return Gaussian(self.mu, self.fwhm, area)
 
     def approximate(self) -> Gaussian:
         peak_start = self.mu_index - self.width() // 2
@@ -39,9 +64,7 @@ class PeakSupervisor:
         return (ydata * xs).sum() / (xs ** 2).sum()
     
     def __save_params(self, mu: float, fwhm: float, area: float) -> None:
-        self.peak.mu = mu
-        self.peak.fwhm = fwhm
-        self.peak.area = area
+        self.peak.update(mu, fwhm, area, self.state)
 
 
 class Analytics:
@@ -55,6 +78,7 @@ class Analytics:
         self.theory_peaks = self.found_theory_peaks()
 
         self.peaks: list[PeakSupervisor] = []
+        self.calibration: CalibrationResult = None
         self.truncate_spectrum()
 
     @property
@@ -74,13 +98,17 @@ class Analytics:
 
         info = f'{self.base.angle} - angle spectrum analysis: \n'
         info += 'Calibrated by equation: E(ch) = ' + \
-        f'{round(self.base.scale_value, 3)} * ch + {round(self.base.scale_shift, 3)}\n'
+        f'{round(self.base.scale_value, 3)} * ch + {round(self.base.scale_shift, 3)}'
+        if self.base.scale_square != 0:
+            info += f' + {self.base.scale_square:.3e} * ch^2'
+        info += '\n'
 
         info += f'--Peaks analysis info--'.center(66) + '\n'
         info += 'Fragment state, MeV'.center(20) + '\t' + 'center, MeV'.center(15) + '\t' 
         info += 'fwhm, MeV'.center(15) + '\t' + 'area'.center(15) + '\n'
         for i in range(len(self.peaks)):
-            info += str(round(self.reaction.residual.states[i], 3)).center(20) + '\t'
+            state = self.peaks[i].state if self.peaks[i].state is not None else self.reaction.residual.states[i]
+            info += str(round(state, 3)).center(20) + '\t'
             info += str(round(self.peaks[i].mu, 3)).center(15) + '\t'
             info += str(round(self.peaks[i].fwhm, 3)).center(15) + '\t'
             info += str(round(self.peaks[i].peak.area, 3)).center(15) + '\n'
@@ -95,83 +123,316 @@ class Analytics:
         solution = np.linalg.solve(matrix, right_side)
 
         self.base.scale_value, self.base.scale_shift = solution[0], solution[1]
+        self.base.scale_square = 0
+        self.calibration = None
         return (self.base.scale_value, self.base.scale_shift)
+
+    def auto_calibrate(self, fwhm: float = 10, degree: int = 1, tolerance: float = None,
+                       threshold: float = 3.0) -> CalibrationResult:
+        '''
+        Calibrates spectrum without anchors: detected peaks are matched to
+        theory peaks by pattern search and refined by weighted least squares.
+        fwhm and tolerance are in channels. Result is kept as calibration,
+        its covariance goes into errors of peak centers (see create_peaks).
+        '''
+        result = auto_calibrate(self.base.spectrum, self.theory_peaks, fwhm, degree, tolerance, threshold,
+                                widths=self.reaction.residual.wigner_widths)
+
+        self.base.scale_value, self.base.scale_shift = result.scale_value, result.scale_shift
+        self.base.scale_square = result.scale_square
+        self.calibration = result
+        return result
+
+    def calibration_errors(self, energies: np.ndarray) -> np.ndarray:
+        '''
+        Errors (MeV) which calibration covariance gives to energies of
+        spectrum, zeros when spectrum was calibrated by anchors.
+        '''
+        energies = np.asarray(energies, dtype=np.float64)
+        if self.calibration is None:
+            return np.zeros(energies.shape)
+
+        channels = np.interp(energies, self.base.energy_view, np.arange(1, len(self.base.spectrum) + 1))
+        return self.calibration.energy_errors(channels)
     
     def energy_view(self) -> np.ndarray:
         return self.base.energy_view
     
-    # TODO: Fix this crouch. Needs little bit architectural touch.
     def found_theory_peaks(self) -> list[float]:
-        collected = []
-        for state in self.reaction.residual.states:
-            energy_after_reaction = self.reaction.fragment_energy(state, self.base.angle)
-            collected.append(energy_after_reaction)
-
-        return collected
+        kinematics = self.reaction.kinematics(self.reaction.residual.states, self.base.angle)
+        return kinematics.fragment_energy[:, 0].tolist()
     
-    def try_find_peaks(self) -> list[int]:
+    def theory_channels(self) -> tuple[list[int], list[int]]:
+        '''
+        Channel indexes of theory peaks inside calibrated spectrum
+        and indexes of their states.
+        '''
         if not self.base.is_calibrated:
             raise RuntimeError('Spectrum must be calibrated before finding peaks.')
-        
-        visible = []
-        for theory in self.theory_peaks:
-            pretend = int((theory - self.base.scale_shift) / self.base.scale_value) - 1
-            if pretend <= 0:
+
+        energies = self.base.energy_view
+        visible, states = [], []
+        for i, theory in enumerate(self.theory_peaks):
+            if not energies[0] < theory <= energies[-1]:
                 continue
 
-            visible.append(pretend)
+            visible.append(PeakSupervisor.nearest_index(energies, theory))
+            states.append(i)
 
-        return visible
+        return (visible, states)
 
-    def create_peaks(self) -> list[PeakSupervisor]:
+    def try_find_peaks(self) -> list[int]:
+        return self.theory_channels()[0]
+
+    def search_peaks(self, resolution: float = None, threshold: float = 3.0,
+                     tolerance: float = None) -> tuple[list[int], list[int]]:
+        '''
+        Automatic peak search matched to theory peaks.\n
+        Resolution is expected fwhm in MeV, tolerance is maximal distance
+        between found and theory energy (one resolution by default).
+        Returns channel indexes of found peaks and indexes of their states.
+        '''
+        if not self.base.is_calibrated:
+            raise RuntimeError('Spectrum must be calibrated before searching peaks.')
+
+        resolution = self.resolution() if resolution is None else resolution
+        tolerance = resolution if tolerance is None else tolerance
+
+        channels = PeakSearch(self.base.spectrum, resolution / self.base.scale_value, threshold).peaks()
+        found, states = match_to_theory(self.base.energy_view[channels], self.theory_peaks, tolerance)
+
+        return (channels[found].tolist(), states.tolist())
+
+    def resolution(self) -> float:
+        '''
+        Expected peak fwhm in MeV when detector resolution is not given:
+        median wigner width of residual states, but not less than 3 channels.
+        '''
+        widths = self.reaction.residual.wigner_widths
+        return max(float(np.median(widths)) if len(widths) else 0, 3 * self.base.scale_value)
+
+    def create_peaks(self, auto: bool = False, resolution: float = None) -> list[PeakSupervisor]:
+        '''
+        Fits peaks on theory positions, or with auto flag on positions
+        found by automatic peak search and matched to theory levels.
+        Resolution is detector fwhm in MeV (see resolution), peak width
+        is never taken narrower than it. Parameters which ended on their
+        bounds get NaN errors (see FitResult.at_bounds), errors of centers
+        include calibration errors (see calibration_errors).
+        '''
         if not self.base.is_calibrated:
             raise RuntimeError('Spectrum must be calibrated before creating peaks.')
 
-        theory_indexes = self.try_find_peaks()
-        for i in range(len(theory_indexes)):
-            xs = self.base.energy_view
-            ys = self.base.spectrum
-            center = self.energy_view()[theory_indexes[i]]
-            gamma = self.reaction.residual.wigner_widths[i]
-
-            current = PeakSupervisor(xs, ys, center, gamma)
+        if auto:
+            theory_indexes, states = self.search_peaks(resolution)
+        else:
+            theory_indexes, states = self.theory_channels()
+
+        if len(theory_indexes) == 0:
+            return self.peaks
+
+        xs = self.base.energy_view
+        ys = self.base.spectrum
+        centers = xs[theory_indexes]
+        resolution = self.resolution() if resolution is None else resolution
+        widths = np.maximum(np.asarray(self.reaction.residual.wigner_widths)[states], resolution)
+
+        result = self.fit_multiplet(xs, ys, centers, widths)
+        mu_errors = np.hypot(result.mu_errors, self.calibration_errors(result.mus))
+        errors = np.column_stack((mu_errors, result.fwhm_errors, result.area_errors))
+        for i in range(len(result)):
+            current = PeakSupervisor(
+                xs, ys, result.mus[i], result.fwhms[i], result.areas[i],
+                self.reaction.residual.states[states[i]], tuple(errors[i])
+            )
             self.peaks.append(current)
 
         self.base.peaks = [supervisor.peak for supervisor in self.peaks]
         return self.peaks
+
+    def fit_multiplet(self, xs: np.ndarray, ys: np.ndarray, centers: np.ndarray, widths: np.ndarray) -> FitResult:
+        '''
+        Fits all peaks of spectrum simultaneously on linear background
+        inside region, which covers every peak with margin of 3 fwhm.
+        Centers are allowed to move only inside their initial fwhm,
+        widths from one channel up to 3 initial fwhm, so a broad
+        component can not turn into a copy of background.
+        '''
+        start = np.searchsorted(xs, (centers - 3 * widths).min())
+        stop = np.searchsorted(xs, (centers + 3 * widths).max()) + 1
+        step = abs(xs[1] - xs[0]) if len(xs) > 1 else widths.min()
+
+        fitter = MultipletFitter(xs[start: stop], ys[start: stop], centers, widths)
+        for i in range(len(centers)):
+            fitter.bound(i, 'mu', centers[i] - widths[i], centers[i] + widths[i])
+            fitter.bound(i, 'fwhm', step, 3 * widths[i])
+
+        return fitter.fit()
     
     def truncate_spectrum(self) -> None:
-        count = 0
-        for i in range(len(self.base.spectrum)):
-            if count >= 50:
-                self.base.spectrum = self.base.spectrum[:i - 20]
-                break
+        cutoff = zero_run_cutoff(self.base.spectrum)
+        if cutoff < len(self.base.spectrum):
+            self.base.spectrum = self.base.spectrum[:cutoff]
+
 
-            if self.base.spectrum[i] == 0:
-                count += 1
-            else:
-                count = 0
+class AngularDistribution:
+    '''
+    Angular distributions of all residual states. Matrices are
+    (states x angles), missing peaks are NaN. Angles are in degrees.
+    '''
+    def __init__(self, states: np.ndarray, lab_angles: np.ndarray, centermass_angles: np.ndarray,
+                 lab_cs: np.ndarray, lab_errors: np.ndarray, centermass_cs: np.ndarray,
+                 centermass_errors: np.ndarray) -> None:
+        self.states = states
+        self.lab_angles = lab_angles
+        self.centermass_angles = centermass_angles
+
+        self.lab_cs = lab_cs
+        self.lab_errors = lab_errors
+        self.centermass_cs = centermass_cs
+        self.centermass_errors = centermass_errors
 
 
 class Sectioner:
-    def __init__(self, reaction: Reaction, spectres: list[Spectrum]) -> None:
+    def __init__(self, reaction: Reaction, spectres: list[Spectrum], normalization: float = 1.0,
+                 tolerance: float = None, normalization_error: float = 0.0) -> None:
+        '''
+        Normalization is 1 / (beam particles * target nuclei per area * solid angle),
+        so that lab cross section is normalization * counts of peak.
+        Errors of counts (fitted area errors, poisson when unknown) and of
+        normalization are added in quadrature.
+        Peaks are assigned to states by nearest theory energy within
+        tolerance (MeV, peak fwhm by default).
+        '''
         self.reaction = reaction
-        self.spectres = spectres
+        self.spectres = sorted(spectres, key=lambda spectrum: spectrum.angle)
+        self.normalization = normalization
+        self.normalization_error = normalization_error
+        self.tolerance = tolerance
+
+        self.angles = np.array([spectrum.angle for spectrum in self.spectres], dtype=np.float64)
+        self.states = np.asarray(self.reaction.residual.states, dtype=np.float64)
+        self.kinematics = self.reaction.kinematics(self.states, self.angles)
+
+        self.counts, self.count_errors = self.__area_matrix()
+
+    def __area_matrix(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        (states x angles) matrix of peak counts and their errors.
+        Counts are fitted areas divided by channel width, errors are
+        fitted area errors scaled the same way or sqrt(counts) if peak has none.
+        States closed at an angle (NaN fragment energy) stay NaN.
+        '''
+        counts = np.full((len(self.states), len(self.angles)), np.nan)
+        errors = np.full((len(self.states), len(self.angles)), np.nan)
+
+        for j, spectrum in enumerate(self.spectres):
+            if len(spectrum.peaks) == 0:
+                continue
+
+            peaks = spectrum.peak_set
+            mus, fwhms, areas, area_errors = peaks.mus, peaks.fwhms, peaks.areas, peaks.area_errors
+
+            tolerance = float(np.median(fwhms)) if self.tolerance is None else self.tolerance
+            found, levels = match_to_theory(mus, self.kinematics.fragment_energy[:, j], tolerance)
+
+            counts[levels, j] = areas[found] / spectrum.scale_value
+            fitted = area_errors[found] / spectrum.scale_value
+            errors[levels, j] = np.where(np.isfinite(fitted), fitted, np.sqrt(counts[levels, j]))
+
+        return (counts, errors)
+
+    def distribution(self) -> AngularDistribution:
+        centermass_angles, jacobian = self.__transformation()
+        constant = self.__g_constant()
+
+        lab_cs, lab_errors = constant * self.counts, self.lab_errors()
+        return AngularDistribution(
+            self.states, self.angles, centermass_angles,
+            lab_cs, lab_errors, lab_cs * jacobian, lab_errors * jacobian
+        )
 
     def centermass_cs(self) -> np.ndarray:
-        pass
+        return self.lab_cs() * self.__transformation()[1]
 
     def lab_cs(self) -> np.ndarray:
-        pass
+        return self.__g_constant() * self.counts
+
+    def lab_errors(self) -> np.ndarray:
+        return np.hypot(self.__g_constant() * self.count_errors, self.normalization_error * self.counts)
+
+    def centermass_errors(self) -> np.ndarray:
+        return self.lab_errors() * self.__transformation()[1]
 
     def centermass_angles(self) -> np.ndarray:
-        pass
+        return self.__transformation()[0]
+
+    def __transformation(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Centre of mass angles (degrees) and jacobian dOmega_lab / dOmega_cm
+        for every (state, angle) cell, in kinematics of reaction
+        (classic or relativistic, see Reaction).
+        '''
+        if self.reaction.relativistic:
+            return self.__relativistic_transformation()
+        return self.__classic_transformation()
+
+    def __classic_transformation(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        J = |1 + x cos(theta_cm)| / (1 + x^2 + 2x cos(theta_cm))^(3/2),
+        where x is ratio of centre of mass velocity to fragment velocity in it.
+        '''
+        lab = np.radians(self.angles)[np.newaxis, :]
+        velocity = np.sqrt(2 * self.kinematics.fragment_energy / self.reaction.fragment.mass)
+        centre = self.__centre_velocity()
+
+        along, across = velocity * np.cos(lab) - centre, velocity * np.sin(lab)
+        centermass = np.arctan2(across, along)
+
+        x = np.sqrt(self.__x_square())
+        cosine = np.cos(centermass)
+        jacobian = np.abs(1 + x * cosine) / (1 + x ** 2 + 2 * x * cosine) ** 1.5
+
+        return (np.degrees(centermass), jacobian)
+
+    def __relativistic_transformation(self) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Fragment four-momentum is boosted into centre of mass frame
+        (masses from mass excesses, as in relativistic kinematics):\n
+        J = gamma p_cm |p - beta E cos(theta)| / p^2,
+        where p, E and theta are lab momentum, total energy and angle.
+        '''
+        lab = np.radians(self.angles)[np.newaxis, :]
+        reaction = self.reaction
+        fragment_mass = reaction.fragment.atomic_mass
+
+        beam_momentum = np.sqrt(reaction.beam_energy ** 2 + 2 * reaction.beam_energy * reaction.beam.atomic_mass)
+        beta = beam_momentum / (reaction.beam_energy + reaction.beam.atomic_mass + reaction.target.atomic_mass)
+        gamma = 1 / np.sqrt(1 - beta ** 2)
+
+        energy = self.kinematics.fragment_energy + fragment_mass
+        momentum = np.sqrt(energy ** 2 - fragment_mass ** 2)
+
+        along, across = gamma * (momentum * np.cos(lab) - beta * energy), momentum * np.sin(lab)
+        centermass = np.arctan2(across, along)
+        jacobian = gamma * np.hypot(along, across) * np.abs(momentum - beta * energy * np.cos(lab)) / momentum ** 2
+
+        return (np.degrees(centermass), jacobian)
+
+    def __centre_velocity(self) -> float:
+        beam_velocity = np.sqrt(2 * self.reaction.beam_energy / self.reaction.beam.mass)
+        return beam_velocity * self.reaction.beam.mass / (self.reaction.beam.mass + self.reaction.target.mass)
 
     def __x_square(self) -> np.ndarray:
-        pass
+        lab = np.radians(self.angles)[np.newaxis, :]
+        velocity = np.sqrt(2 * self.kinematics.fragment_energy / self.reaction.fragment.mass)
+        centre = self.__centre_velocity()
+
+        fragment_square = velocity ** 2 + centre ** 2 - 2 * velocity * centre * np.cos(lab)
+        return centre ** 2 / fragment_square
 
     def __g_constant(self) -> float:
-        pass
+        return self.normalization
 
 
 if __name__ == '__main__':
@@ -1,11 +1,30 @@
+from __future__ import annotations
 import numpy as np
 
 
 class Peak:
+    __slots__ = ('__mu', '__fwhm', '__area', '__state', '__mu_error', '__fwhm_error', '__area_error')
+
     def __init__(self) -> None:
         self.__mu = 0
         self.__fwhm = 1
         self.__area = 1
+        self.__state = None
+
+        self.__mu_error = np.nan
+        self.__fwhm_error = np.nan
+        self.__area_error = np.nan
+
+    def update(self, mu: float, fwhm: float, area: float, state: float | None = None) -> None:
+        '''
+        Sets all parameters at once with one validation.
+        '''
+        if fwhm <= 0 or area <= 0:
+            raise ValueError("FWHM and area of peak should be greater than zero.")
+        self.__mu, self.__fwhm, self.__area, self.__state = mu, fwhm, area, state
+
+    def update_errors(self, mu_error: float, fwhm_error: float, area_error: float) -> None:
+        self.__mu_error, self.__fwhm_error, self.__area_error = mu_error, fwhm_error, area_error
 
     @property
     def mu(self) -> float:
@@ -35,20 +54,143 @@ class Peak:
             raise ValueError("Area of peak should be greater than zero.")
         self.__area = input
 
+    @property
+    def state(self) -> float | None:
+        return self.__state
+
+    @state.setter
+    def state(self, input: float | None) -> None:
+        self.__state = input
+
+    @property
+    def mu_error(self) -> float:
+        return self.__mu_error
+
+    @property
+    def fwhm_error(self) -> float:
+        return self.__fwhm_error
+
+    @property
+    def area_error(self) -> float:
+        return self.__area_error
+
     @property
     def hwhm(self) -> float:
         return self.__fwhm / 2
 
 
+class PeakSet:
+    '''
+    Many peaks kept in parallel float64 arrays (struct of arrays).
+    Validation is done once for the whole set, unassigned state
+    and unknown errors are NaN.
+    Iteration and integer indexing give Peak objects for code which
+    works with single peaks.
+    '''
+    __slots__ = ('mus', 'fwhms', 'areas', 'states', 'mu_errors', 'fwhm_errors', 'area_errors')
+
+    def __init__(self, mus: np.ndarray, fwhms: np.ndarray, areas: np.ndarray, states: np.ndarray = None,
+                 mu_errors: np.ndarray = None, fwhm_errors: np.ndarray = None,
+                 area_errors: np.ndarray = None) -> None:
+        self.mus = np.ascontiguousarray(mus, dtype=np.float64)
+        self.fwhms = np.ascontiguousarray(fwhms, dtype=np.float64)
+        self.areas = np.ascontiguousarray(areas, dtype=np.float64)
+        if states is None:
+            self.states = np.full(len(self.mus), np.nan)
+        elif isinstance(states, np.ndarray):
+            self.states = np.ascontiguousarray(states, dtype=np.float64)
+        else:
+            self.states = np.array([np.nan if state is None else state for state in states], dtype=np.float64)
+
+        self.mu_errors = PeakSet.__optional(mu_errors, len(self.mus))
+        self.fwhm_errors = PeakSet.__optional(fwhm_errors, len(self.mus))
+        self.area_errors = PeakSet.__optional(area_errors, len(self.mus))
+
+        lengths = {len(array) for array in (self.mus, self.fwhms, self.areas, self.states,
+                                           self.mu_errors, self.fwhm_errors, self.area_errors)}
+        if len(lengths) > 1:
+            raise ValueError("All parameters of peak set must have the same length.")
+        if not np.all(self.fwhms > 0):
+            raise ValueError("FWHM of peak should be greater than zero.")
+        if not np.all(self.areas > 0):
+            raise ValueError("Area of peak should be greater than zero.")
+
+    @staticmethod
+    def __optional(values: np.ndarray, length: int) -> np.ndarray:
+        if values is None:
+            return np.full(length, np.nan)
+        return np.ascontiguousarray(values, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.mus)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def __getitem__(self, selection: int | slice | np.ndarray) -> Peak | PeakSet:
+        if isinstance(selection, (int, np.integer)):
+            peak = Peak()
+            state = self.states[selection]
+            peak.update(float(self.mus[selection]), float(self.fwhms[selection]),
+                        float(self.areas[selection]), None if np.isnan(state) else float(state))
+            peak.update_errors(float(self.mu_errors[selection]), float(self.fwhm_errors[selection]),
+                               float(self.area_errors[selection]))
+            return peak
+
+        return PeakSet(
+            self.mus[selection], self.fwhms[selection], self.areas[selection], self.states[selection],
+            self.mu_errors[selection], self.fwhm_errors[selection], self.area_errors[selection]
+        )
+
+    @property
+    def hwhms(self) -> np.ndarray:
+        return self.fwhms / 2
+
+    @property
+    def nbytes(self) -> int:
+        return sum(getattr(self, name).nbytes for name in PeakSet.__slots__)
+
+    @staticmethod
+    def from_peaks(peaks: list[Peak]) -> PeakSet:
+        if isinstance(peaks, PeakSet):
+            return peaks
+
+        return PeakSet(
+            [peak.mu for peak in peaks],
+            [peak.fwhm for peak in peaks],
+            [peak.area for peak in peaks],
+            [peak.state for peak in peaks],
+            [peak.mu_error for peak in peaks],
+            [peak.fwhm_error for peak in peaks],
+            [peak.area_error for peak in peaks]
+        )
+
+    @staticmethod
+    def concatenate(sets: list[PeakSet]) -> PeakSet:
+        columns = [np.concatenate([getattr(peaks, name) for peaks in sets] + [[]]) for name in PeakSet.__slots__]
+        return PeakSet(*columns)
+
+    def to_peaks(self) -> list[Peak]:
+        return list(self)
+
+
 class Spectrum:
+    __slots__ = (
+        '__angle', '__spectrum', '__scale_value', '__scale_shift',
+        '__scale_square', '__energy_view', '__peaks'
+    )
+
     def __init__(self) -> None:
         self.__angle = 0
         self.__spectrum = np.array([])
 
         self.__scale_value = 0
         self.__scale_shift = 0
+        self.__scale_square = 0
+        self.__energy_view = None
 
-        self.__peaks: list[Peak] = list()
+        self.__peaks: list[Peak] | PeakSet = list()
 
     @property
     def angle(self) -> float:
@@ -69,10 +211,21 @@ class Spectrum:
         if len(input) == 0:
             raise ValueError("Spectrum doesn't be empty")
         self.__spectrum = input
+        self.__energy_view = None
 
     @property
     def energy_view(self) -> np.ndarray:
-        return np.arange(1, len(self.__spectrum) + 1) * self.scale_value + self.scale_shift
+        '''
+        Read-only energy axis. Computed lazily and cached until
+        spectrum or calibration changes, so callers share one array.
+        '''
+        if self.__energy_view is None:
+            channels = np.arange(1, len(self.__spectrum) + 1)
+            self.__energy_view = channels * self.scale_value + self.scale_shift
+            if self.__scale_square != 0:
+                self.__energy_view += self.__scale_square * channels ** 2
+            self.__energy_view.flags.writeable = False
+        return self.__energy_view
 
     @property
     def calibration(self) -> tuple[float, float]:
@@ -87,6 +240,7 @@ class Spectrum:
         if input <= 0:
             raise ValueError("Scale value can't be negative or equal to 0.")
         self.__scale_value = input
+        self.__energy_view = None
 
     @property
     def scale_shift(self) -> float:
@@ -95,19 +249,33 @@ class Spectrum:
     @scale_shift.setter
     def scale_shift(self, input: float) -> None:
         self.__scale_shift = input
+        self.__energy_view = None
+
+    @property
+    def scale_square(self) -> float:
+        return self.__scale_square
+
+    @scale_square.setter
+    def scale_square(self, input: float) -> None:
+        self.__scale_square = input
+        self.__energy_view = None
 
     @property
     def is_calibrated(self) -> bool:
         return not self.__scale_value <= 0 and not self.__scale_shift == 0
 
     @property
-    def peaks(self) -> list[Peak]:
+    def peaks(self) -> list[Peak] | PeakSet:
         return self.__peaks
     
     @peaks.setter
-    def peaks(self, pretend: list[Peak]) -> None:
+    def peaks(self, pretend: list[Peak] | PeakSet) -> None:
         self.__peaks = pretend
 
+    @property
+    def peak_set(self) -> PeakSet:
+        return PeakSet.from_peaks(self.__peaks)
+
 
 if __name__ == '__main__':
     pass
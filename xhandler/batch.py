@@ -0,0 +1,125 @@
+import os, sys
+from concurrent.futures import ProcessPoolExecutor
+
+from base import Spectrum
+from analysis import Analytics
+from shunting_yard import ReactionMaster
+from spectra import Sleuth
+from calibration import CalibrationResult, calibrate_directory
+
+
+class BatchResult:
+    def __init__(self, angle: float, report: str = '', spectrum: Spectrum = None, error: str = None) -> None:
+        self.angle = angle
+        self.report = report
+        self.spectrum = spectrum
+        self.error = error
+
+    @property
+    def is_failed(self) -> bool:
+        return self.error is not None
+
+
+def calibration_for(calibration: str | tuple[float, float] | CalibrationResult | dict[float, tuple[float, float]],
+                    angle: float) -> str | tuple[float, float] | CalibrationResult:
+    '''
+    Calibration source is either one (scale value, scale shift) pair
+    or CalibrationResult shared by all angles, dictionary of such pairs
+    keyed by angle, 'auto' for automatic calibration of every angle or
+    'global' for one calibration fitted to all angles at once.
+    '''
+    if isinstance(calibration, dict):
+        if angle not in calibration:
+            raise ValueError(f'There is no calibration for {angle} angle.')
+        return calibration[angle]
+
+    return calibration
+
+
+def analyze_angle(reaction: str, energy: float, directory: str, angle: float,
+                  calibration: str | tuple[float, float] | CalibrationResult, relativistic: bool = False,
+                  fwhm: float = 10, tolerance: float = None) -> BatchResult:
+    '''
+    Non-interactive analysis of one angle:
+    load -> truncate -> calibrate -> create peaks -> report.
+    fwhm and tolerance (in channels) are used by automatic calibration,
+    angle which can not be calibrated reliably is reported as failed.
+    '''
+    try:
+        analytics = Analytics(
+            Sleuth(directory).to_spectrum(angle),
+            ReactionMaster(reaction, energy).to_reaction(relativistic),
+            angle
+        )
+
+        if calibration == 'auto':
+            analytics.auto_calibrate(fwhm, tolerance=tolerance)
+        elif isinstance(calibration, CalibrationResult):
+            analytics.base.scale_value, analytics.base.scale_shift = calibration.scale_value, calibration.scale_shift
+            analytics.base.scale_square = calibration.scale_square
+            analytics.calibration = calibration
+        else:
+            analytics.base.scale_value, analytics.base.scale_shift = calibration
+        analytics.create_peaks()
+
+        return BatchResult(angle, str(analytics), analytics.base)
+    except Exception as error:
+        return BatchResult(angle, error=f'{type(error).__name__}: {error}')
+
+
+def run_batch(reaction: str, energy: float, directory: str,
+              calibration: str | tuple[float, float] | dict[float, tuple[float, float]],
+              workers: int = None, relativistic: bool = False,
+              fwhm: float = 10, tolerance: float = None) -> list[BatchResult]:
+    '''
+    Analyzes every angle found in directory on process pool.
+    Relativistic flag selects kinematics of reaction (see Reaction),
+    fwhm and tolerance (in channels) go to automatic calibration.
+    Results are returned in angle order.
+    '''
+    sleuth = Sleuth(directory)
+    angles = sorted(sleuth.angles)
+
+    if calibration == 'global':
+        shared = calibrate_directory(sleuth, ReactionMaster(reaction, energy).to_reaction(relativistic),
+                                     fwhm, tolerance=tolerance)
+        calibration = shared
+
+    calibrations = [calibration_for(calibration, angle) for angle in angles]
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        return list(executor.map(
+            analyze_angle,
+            [reaction] * len(angles),
+            [energy] * len(angles),
+            [directory] * len(angles),
+            angles,
+            calibrations,
+            [relativistic] * len(angles),
+            [fwhm] * len(angles),
+            [tolerance] * len(angles)
+        ))
+
+
+if __name__ == '__main__':
+    options = dict(arg[2:].partition('=')[::2] for arg in sys.argv if arg.startswith('--'))
+    argv = [arg for arg in sys.argv if not arg.startswith('--')]
+
+    if len(argv) < 5:
+        print('Usage: batch.py [--relativistic] [--fwhm=CHANNELS] [--tolerance=CHANNELS] '
+              'REACTION ENERGY DIRECTORY (auto | global | SCALE_VALUE SCALE_SHIFT) [WORKERS]')
+        sys.exit(1)
+
+    if argv[4] in ['auto', 'global']:
+        calibration, rest = argv[4], argv[5:]
+    else:
+        calibration, rest = (float(argv[4]), float(argv[5])), argv[6:]
+
+    results = run_batch(
+        argv[1], float(argv[2]), argv[3], calibration,
+        int(rest[0]) if rest else None, 'relativistic' in options,
+        float(options.get('fwhm', 10)), float(options['tolerance']) if 'tolerance' in options else None
+    )
+
+    for result in results:
+        print(result.report if not result.is_failed else f'{result.angle} - angle failed: {result.error}\n')
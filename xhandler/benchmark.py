@@ -0,0 +1,86 @@
+import sys, time
+import numpy as np
+
+from physics import Reaction
+from shunting_yard import ReactionMaster
+
+
+def time_kinematics(reaction: Reaction, states: np.ndarray, angles: np.ndarray, repeats: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeats):
+        reaction.kinematics(states, angles)
+
+    return (time.perf_counter() - start) / repeats
+
+
+def classic_energy(reaction: Reaction, states: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    '''
+    Fragment energies (states x angles) of classic r/s factors taken with
+    atomic masses, which relativistic kinematics use, so deviation from
+    relativistic energies is due to relativity alone, not to mass model.
+    '''
+    beam, fragment = reaction.beam.atomic_mass, reaction.fragment.atomic_mass
+    residual = reaction.residual.atomic_mass
+    quits = reaction.reaction_quit(np.asarray(states, dtype=np.float64))[:, np.newaxis]
+    cosine = np.cos(np.radians(np.asarray(angles, dtype=np.float64)))[np.newaxis, :]
+
+    r = np.sqrt(beam * fragment * reaction.beam_energy) * cosine / (fragment + residual)
+    s = (reaction.beam_energy * (residual - beam) + residual * quits) / (fragment + residual)
+    with np.errstate(invalid='ignore'):
+        return (r + np.sqrt(r ** 2 + s)) ** 2
+
+
+def benchmark_kinematics(reactions: list[str], energies: list[float], states: np.ndarray,
+                         angles: np.ndarray, repeats: int = 20) -> list[dict]:
+    '''
+    Compares classic and relativistic kinematics over a grid of
+    reactions and beam energies. For every grid point returns throughput
+    of both engines (cells per second) and deviation of classic fragment
+    energies from relativistic ones (MeV) on the same atomic masses
+    (see classic_energy).
+    '''
+    rows = []
+    cells = len(states) * len(angles)
+
+    for notation in reactions:
+        for energy in energies:
+            classic = ReactionMaster(notation, energy).to_reaction()
+            relativistic = Reaction(classic.beam, classic.target, classic.fragment, energy, relativistic=True)
+
+            classic_time = time_kinematics(classic, states, angles, repeats)
+            relativistic_time = time_kinematics(relativistic, states, angles, repeats)
+
+            deviation = classic_energy(classic, states, angles) - \
+                relativistic.kinematics(states, angles).fragment_energy
+
+            rows.append({
+                'reaction': notation,
+                'energy': energy,
+                'classic_rate': cells / classic_time,
+                'relativistic_rate': cells / relativistic_time,
+                'max_deviation': float(np.nanmax(np.abs(deviation))) if np.isfinite(deviation).any() else np.nan,
+                'mean_deviation': float(np.nanmean(np.abs(deviation))) if np.isfinite(deviation).any() else np.nan,
+            })
+
+    return rows
+
+
+def report(rows: list[dict]) -> str:
+    info = 'reaction'.center(24) + '\t' + 'E, MeV'.center(8) + '\t' + 'classic, cells/s'.center(18) + '\t'
+    info += 'relativistic, cells/s'.center(22) + '\t' + 'max |dE|, MeV'.center(14) + '\t'
+    info += 'mean |dE|, MeV'.center(14) + '\n'
+
+    for row in rows:
+        info += row['reaction'].center(24) + '\t' + str(row['energy']).center(8) + '\t'
+        info += f"{row['classic_rate']:.3e}".center(18) + '\t' + f"{row['relativistic_rate']:.3e}".center(22) + '\t'
+        info += f"{row['max_deviation']:.4f}".center(14) + '\t' + f"{row['mean_deviation']:.4f}".center(14) + '\n'
+
+    return info
+
+
+if __name__ == '__main__':
+    reactions = sys.argv[1:] or ['Li7(d, t)Li6']
+    energies = [5.0, 14.5, 30.0, 60.0]
+
+    rows = benchmark_kinematics(reactions, energies, np.linspace(0, 10, 200), np.linspace(5, 170, 40))
+    print(report(rows))
@@ -0,0 +1,119 @@
+import os, pickle, tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from analysis import Analytics
+
+
+def footprint(analytics: Analytics) -> int:
+    '''
+    Rough number of bytes held by arrays of analyzed spectrum.
+    Arrays shared between spectrum and its peaks are counted once.
+    '''
+    arrays = [analytics.spectrum]
+    for supervisor in analytics.peaks:
+        arrays += [supervisor.x_data, supervisor.y_data]
+
+    owners = {}
+    for array in arrays:
+        owner = array if array.base is None or not isinstance(array.base, np.ndarray) else array.base
+        owners[id(owner)] = max(owners.get(id(owner), 0), array.nbytes)
+
+    return sum(owners.values())
+
+
+class AnalyticsCache:
+    '''
+    Analyzed spectres keyed by angle with O(1) lookup.
+    When memory held by cached analyses exceeds max_bytes the least
+    recently used ones are spilled to disk and restored on request.
+    '''
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, spill_directory: str = None) -> None:
+        self.max_bytes = max_bytes
+        self.spill_directory = spill_directory
+
+        self.__memory: OrderedDict[float, Analytics] = OrderedDict()
+        self.__sizes: dict[float, int] = {}
+        self.__spilled: dict[float, str] = {}
+        self.__lock = threading.RLock()
+
+    def __contains__(self, angle: float) -> bool:
+        return angle in self.__memory or angle in self.__spilled
+
+    def __len__(self) -> int:
+        return len(self.__memory) + len(self.__spilled)
+
+    @property
+    def angles(self) -> list[float]:
+        return sorted(list(self.__memory) + list(self.__spilled))
+
+    @property
+    def memory_usage(self) -> int:
+        return sum(self.__sizes.values())
+
+    def put(self, analytics: Analytics) -> None:
+        with self.__lock:
+            angle = analytics.angle
+            self.__forget_spilled(angle)
+
+            self.__memory[angle] = analytics
+            self.__memory.move_to_end(angle)
+            self.__sizes[angle] = footprint(analytics)
+
+            self.__shrink()
+
+    def get(self, angle: float) -> Analytics:
+        with self.__lock:
+            if angle in self.__memory:
+                self.__memory.move_to_end(angle)
+                return self.__memory[angle]
+
+            if angle not in self.__spilled:
+                raise KeyError(f'{angle} angle spectrum was not analyzed.')
+
+            with open(self.__spilled[angle], 'rb') as file:
+                analytics = pickle.load(file)
+
+            self.put(analytics)
+            return analytics
+
+    def remove(self, angle: float) -> None:
+        with self.__lock:
+            self.__memory.pop(angle, None)
+            self.__sizes.pop(angle, None)
+            self.__forget_spilled(angle)
+
+    def clear(self) -> None:
+        with self.__lock:
+            for angle in list(self.__spilled):
+                self.__forget_spilled(angle)
+
+            self.__memory.clear()
+            self.__sizes.clear()
+
+    def __shrink(self) -> None:
+        while len(self.__memory) > 1 and self.memory_usage > self.max_bytes:
+            angle, analytics = self.__memory.popitem(last=False)
+            self.__sizes.pop(angle)
+            self.__spill(angle, analytics)
+
+    def __spill(self, angle: float, analytics: Analytics) -> None:
+        if self.spill_directory is None:
+            self.spill_directory = tempfile.mkdtemp(prefix='xhandler-')
+
+        path = os.path.join(self.spill_directory, f'{angle}.pickle')
+        with open(path, 'wb') as file:
+            pickle.dump(analytics, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+        self.__spilled[angle] = path
+
+    def __forget_spilled(self, angle: float) -> None:
+        path = self.__spilled.pop(angle, None)
+        if path is not None and os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    pass
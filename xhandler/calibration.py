@@ -0,0 +1,558 @@
+import numpy as np
+from typing import Callable
+from peaksearch import PeakSearch, match_to_theory
+from preprocess import zero_run_cutoff
+from physics import Reaction
+from spectra import Sleuth
+
+
+PATTERN_LEVELS = 20
+PATTERN_CANDIDATES = 40
+LEVEL_REACH = 3
+CANDIDATE_REACH = 6
+SCORE_CHUNK = 2 ** 20
+LEVEL_PENALTY = 0.5
+GROUND_PENALTY = 2.0
+AMBIGUITY = 0.9
+RIVALS = 5
+AGREEMENT = 0.5
+REFINE_STEPS = 5
+MIN_MATCHED = 3
+RMS_LIMIT = 0.5
+
+
+class CalibrationResult:
+    '''
+    Energy calibration E(ch) = sum(coefficients[k] * ch^k), channels
+    are numbered from 1 as in Spectrum.energy_view.
+    Covariance is of coefficients, estimated from scatter of matched peaks.
+    '''
+    def __init__(self, coefficients: np.ndarray, channels: np.ndarray, energies: np.ndarray,
+                 weights: np.ndarray, states: np.ndarray, covariance: np.ndarray = None) -> None:
+        self.coefficients = coefficients
+        self.covariance = np.full((len(coefficients), len(coefficients)), np.nan) if covariance is None \
+            else covariance
+        self.channels = channels
+        self.energies = energies
+        self.weights = weights
+        self.states = states
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    @property
+    def degree(self) -> int:
+        return len(self.coefficients) - 1
+
+    @property
+    def scale_shift(self) -> float:
+        return float(self.coefficients[0])
+
+    @property
+    def scale_value(self) -> float:
+        return float(self.coefficients[1])
+
+    @property
+    def scale_square(self) -> float:
+        return float(self.coefficients[2]) if self.degree >= 2 else 0.0
+
+    @property
+    def residuals(self) -> np.ndarray:
+        return self.energies - self.energy(self.channels)
+
+    @property
+    def rms(self) -> float:
+        return float(np.sqrt(np.mean(self.residuals ** 2))) if len(self) else np.nan
+
+    @property
+    def coefficient_errors(self) -> np.ndarray:
+        return np.sqrt(np.diag(self.covariance))
+
+    def energy(self, channels: np.ndarray) -> np.ndarray:
+        return np.polynomial.polynomial.polyval(channels, self.coefficients)
+
+    def energy_errors(self, channels: np.ndarray, channel_errors: np.ndarray = None) -> np.ndarray:
+        '''
+        Standard deviation of E(ch) for every channel: calibration covariance
+        propagated as diag(V C V^T) with V the powers of channels, plus
+        error of channel position itself (e.g. fitted peak center) if given.
+        '''
+        channels = np.asarray(channels, dtype=np.float64)
+        powers = channels[..., np.newaxis] ** np.arange(self.degree + 1)
+        variance = np.einsum('...i,ij,...j->...', powers, self.covariance, powers)
+
+        if channel_errors is not None:
+            slope = np.polynomial.polynomial.polyval(channels, np.polynomial.polynomial.polyder(self.coefficients))
+            variance = variance + (slope * channel_errors) ** 2
+
+        return np.sqrt(variance)
+
+
+class GlobalCalibrationResult(CalibrationResult):
+    '''
+    Calibration shared by spectres of several angles.
+    Every matched peak also keeps its angle.
+    '''
+    def __init__(self, coefficients: np.ndarray, channels: np.ndarray, energies: np.ndarray,
+                 weights: np.ndarray, states: np.ndarray, angles: np.ndarray, covariance: np.ndarray = None) -> None:
+        super().__init__(coefficients, channels, energies, weights, states, covariance)
+        self.angles = angles
+
+    def residuals_of(self, angle: float) -> np.ndarray:
+        return self.residuals[self.angles == angle]
+
+
+def candidate_peaks(spectrum: np.ndarray, fwhm: float, threshold: float = 3.0,
+                    count: int = None) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Channel numbers (from 1, refined by parabolic interpolation of
+    second derivative response) and significances of the `count`
+    most significant peaks of uncalibrated spectrum.
+    '''
+    search = PeakSearch(spectrum, fwhm, threshold)
+    indexes = search.peaks()
+    significances = search.significance[indexes]
+
+    if count is not None and len(indexes) > count:
+        strongest = np.sort(np.argsort(significances)[::-1][:count])
+        indexes, significances = indexes[strongest], significances[strongest]
+
+    left, middle, right = search.response[indexes - 1], search.response[indexes], search.response[indexes + 1]
+    curvature = left - 2 * middle + right
+    offsets = np.where(curvature < 0, 0.5 * (left - right) / np.where(curvature < 0, curvature, -1), 0)
+
+    return (indexes + 1 + np.clip(offsets, -0.5, 0.5), significances)
+
+
+def pattern_search(channels: np.ndarray, significances: np.ndarray, theory: np.ndarray,
+                   tolerance: float, scale_range: tuple[float, float] = (0, np.inf),
+                   widths: np.ndarray = None) -> tuple[float, float]:
+    '''
+    Tries linear calibrations that map a pair of neighbouring strong
+    candidate peaks onto a pair of neighbouring low theory levels and scores
+    them by summed significance of all candidates landing within tolerance
+    (in channels) of any theory energy, minus penalties for theory levels
+    which no candidate matches (see level_penalties, score_hypotheses).
+    Theory and wigner widths are in order of states.
+    Returns best (scale value, scale shift), raises RuntimeError when
+    it is ambiguous (see best_hypothesis).
+    '''
+    theory = np.asarray(theory, dtype=np.float64)
+    levels = pattern_levels(theory)
+    if len(levels) < 2:
+        raise RuntimeError('At least two theory peaks are needed for calibration.')
+
+    anchors = strongest_channels(channels, significances, PATTERN_CANDIDATES)
+    scales, shifts = hypotheses(anchors, levels, scale_range)
+
+    is_finite = np.isfinite(theory)
+    finite = theory[is_finite]
+    order = np.argsort(finite)
+    penalties, grounds = level_penalties(len(finite), significances)
+    widths = np.zeros(len(theory)) if widths is None else np.asarray(widths, dtype=np.float64)
+
+    def rescored(scales: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+        return score_hypotheses(scales, shifts, channels, significances, finite[order], tolerance,
+                                penalties=penalties[order], grounds=grounds[order],
+                                widths=widths[is_finite][order])
+
+    return best_hypothesis(
+        scales, shifts, rescored(scales, shifts), tolerance, channels,
+        lambda guess: refine(channels, significances, theory, guess, tolerance), rescored
+    )
+
+
+def level_penalties(count: int, significances: np.ndarray,
+                    ground: np.ndarray | int = 0) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Score lost when theory level has no candidate: GROUND_PENALTY mean
+    significances for ground state line, LEVEL_PENALTY for other levels,
+    reduced by share of levels which candidates can fill at all, since
+    most levels of dense schemes are not populated. It makes a hypothesis
+    which shifts peaks by one level or squeezes them onto far levels,
+    leaving ground state line or narrow levels empty, lose to the true one.
+    Returns penalties and mask of ground state lines.
+    '''
+    unit = float(np.mean(significances)) if len(significances) else 0.0
+    grounds = np.zeros(count, dtype=np.bool_)
+    grounds[ground] = True
+
+    filled = min(len(significances) / max(count - int(grounds.sum()), 1), 1.0)
+    return (np.where(grounds, GROUND_PENALTY, LEVEL_PENALTY * filled) * unit, grounds)
+
+
+def best_hypothesis(scales: np.ndarray, shifts: np.ndarray, scores: np.ndarray, tolerance: float,
+                    channels: np.ndarray, refined: Callable[[tuple[float, float]], CalibrationResult],
+                    rescored: Callable[[np.ndarray, np.ndarray], np.ndarray]) -> tuple[float, float]:
+    '''
+    Best hypothesis after refinement. RIVALS best scored distinct
+    hypotheses (see distinct_hypotheses) are refined (up to REFINE_STEPS
+    times, until number of matched peaks settles) and scored again.
+    Refined calibrations which agree with the best one on less than
+    AGREEMENT of its peaks (see agreement) are rivals: if a rival scores at least AMBIGUITY
+    of the best one, calibration is ambiguous and RuntimeError is raised.
+    '''
+    settled: list[CalibrationResult] = []
+    for i in distinct_hypotheses(scales, shifts, scores, tolerance, channels, RIVALS):
+        try:
+            result = refined((float(scales[i]), float(shifts[i])))
+            for _ in range(REFINE_STEPS):
+                previous, result = result, refined((result.scale_value, result.scale_shift))
+                if len(result) == len(previous):
+                    break
+        except RuntimeError:
+            continue
+
+        settled.append(result)
+
+    if len(settled) == 0:
+        raise RuntimeError('No calibration hypothesis matches theory peaks.')
+
+    scales = np.array([result.scale_value for result in settled])
+    shifts = np.array([result.scale_shift for result in settled])
+    scores = rescored(scales, shifts)
+    best = int(np.argmax(scores))
+    if scores[best] <= 0:
+        raise RuntimeError('No calibration hypothesis matches theory peaks.')
+
+    is_other = np.array([agreement(settled[best], result) < AGREEMENT for result in settled])
+    if is_other.any() and scores[is_other].max() >= AMBIGUITY * scores[best]:
+        other = np.flatnonzero(is_other)[np.argmax(scores[is_other])]
+        raise RuntimeError(
+            f'Calibration is ambiguous: {scales[best]:.5f} * ch + {shifts[best]:.3f} and '
+            f'{scales[other]:.5f} * ch + {shifts[other]:.3f} match theory equally well.'
+        )
+
+    return (float(scales[best]), float(shifts[best]))
+
+
+def is_duplicate(scales: np.ndarray, shifts: np.ndarray, reference: int,
+                 tolerance: float, channels: np.ndarray) -> np.ndarray:
+    '''
+    Hypotheses whose energies of the lowest and highest candidate
+    channels are within tolerance of the reference hypothesis.
+    '''
+    ends = np.array([channels.min(), channels.max()], dtype=np.float64)
+    energies = scales[:, np.newaxis] * ends + shifts[:, np.newaxis]
+    return (np.abs(energies - energies[reference]) <= tolerance * scales[reference]).all(axis=1)
+
+
+def agreement(first: CalibrationResult, second: CalibrationResult) -> float:
+    '''
+    Weighted share of peaks of the first calibration which the second
+    one assigns to the same levels.
+    '''
+    def assignments(result: CalibrationResult) -> dict[tuple[float, float], int]:
+        angles = getattr(result, 'angles', np.zeros(len(result)))
+        return dict(zip(zip(angles.tolist(), result.channels.tolist()), result.states.tolist()))
+
+    matched = assignments(second)
+    is_same = [matched.get(key) == state for key, state in assignments(first).items()]
+    return float((first.weights * is_same).sum() / first.weights.sum()) if len(first) else 0.0
+
+
+def distinct_hypotheses(scales: np.ndarray, shifts: np.ndarray, scores: np.ndarray, tolerance: float,
+                        channels: np.ndarray, count: int) -> list[int]:
+    '''
+    Indexes of up to `count` best scored hypotheses, none of them
+    is a duplicate of better one.
+    '''
+    picked = []
+    is_covered = np.zeros(len(scales), dtype=np.bool_)
+    for i in np.argsort(scores, kind='stable')[::-1]:
+        if len(picked) == count:
+            break
+        if is_covered[i]:
+            continue
+
+        picked.append(int(i))
+        is_covered |= is_duplicate(scales, shifts, i, tolerance, channels)
+
+    return picked
+
+
+def check_calibration(result: CalibrationResult, tolerance: float) -> CalibrationResult:
+    '''
+    Rejects calibration with less than MIN_MATCHED peaks (and not more
+    than its coefficients) or with rms of residuals above RMS_LIMIT
+    tolerances (in channels).
+    '''
+    if len(result) < max(MIN_MATCHED, result.degree + 2):
+        raise RuntimeError(f'Only {len(result)} peaks were matched, calibration is not reliable.')
+    if result.rms > RMS_LIMIT * tolerance * abs(result.scale_value):
+        raise RuntimeError(f'Calibration residuals are too large: rms is {result.rms:.4f} MeV.')
+
+    return result
+
+
+def pattern_levels(theory: np.ndarray, limit: int = PATTERN_LEVELS) -> np.ndarray:
+    '''
+    Theory energies used to build hypotheses: finite and positive energies
+    of the `limit` lowest states (theory is in order of states), ascending.
+    '''
+    theory = np.asarray(theory, dtype=np.float64)
+    return np.sort(theory[np.isfinite(theory) & (theory > 0)][:limit])
+
+
+def strongest_channels(channels: np.ndarray, significances: np.ndarray, limit: int) -> np.ndarray:
+    '''
+    Channels of the `limit` most significant candidates, ascending.
+    '''
+    if len(channels) <= limit:
+        return np.sort(channels)
+    return np.sort(channels[np.argsort(significances)[::-1][:limit]])
+
+
+def neighbour_pairs(count: int, reach: int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Index pairs (i, j) with i < j <= i + reach.
+    '''
+    first = np.repeat(np.arange(count), reach)
+    second = first + np.tile(np.arange(1, reach + 1), count)
+    is_inside = second < count
+    return (first[is_inside], second[is_inside])
+
+
+def score_hypotheses(scales: np.ndarray, shifts: np.ndarray, channels: np.ndarray, significances: np.ndarray,
+                     line: np.ndarray, tolerance: float, offsets: np.ndarray | float = 0.0,
+                     penalties: np.ndarray = None, grounds: np.ndarray | bool = False,
+                     widths: np.ndarray | float = 0.0, groups: np.ndarray = None) -> np.ndarray:
+    '''
+    Summed significance of candidates which land within tolerance (in
+    channels) of sorted theory line under every hypothesis. Offsets are
+    added to predicted energies of candidates (see global_calibrate).\n
+    With penalties (aligned with line) penalty of every level which no
+    candidate matched is subtracted, if the level lies between matched
+    levels of its group (spectrum of one angle, groups are ascending
+    along line). Ground state lines (grounds mask) are penalized
+    wherever they fall. Levels with wigner widths (MeV) above tolerance
+    are neither matched nor penalized, narrow peak search is not
+    expected to find them.\n
+    Hypotheses are scored in chunks, so at most SCORE_CHUNK
+    predictions are held in memory at once.
+    '''
+    scores = np.zeros(len(scales))
+    if len(line) == 0 or len(channels) == 0:
+        return scores
+
+    padded = line if len(line) > 1 else np.repeat(line, 2)
+    widths = np.broadcast_to(widths, line.shape)
+    indexes = np.arange(len(line))
+    groups = np.zeros(len(line), dtype=np.int64) if groups is None else groups
+    firsts = np.searchsorted(groups, groups, side='left')
+    lasts = np.searchsorted(groups, groups, side='right') - 1
+    step = max(SCORE_CHUNK // (len(channels) + len(line)), 1)
+    for start in range(0, len(scales), step):
+        scale = scales[start: start + step, np.newaxis]
+        shift = shifts[start: start + step, np.newaxis]
+        predicted = scale * channels[np.newaxis, :] + shift + offsets
+
+        positions = np.clip(np.searchsorted(padded, predicted), 1, len(padded) - 1)
+        left, right = np.abs(predicted - padded[positions - 1]), np.abs(predicted - padded[positions])
+        nearest = np.minimum(np.where(left <= right, positions - 1, positions), len(line) - 1)
+        is_narrow = widths <= tolerance * scale
+        is_matched = (np.minimum(left, right) <= tolerance * scale) & np.take_along_axis(is_narrow, nearest, axis=1)
+        scores[start: start + step] = (is_matched * significances[np.newaxis, :]).sum(axis=1)
+
+        if penalties is None:
+            continue
+
+        rows = np.broadcast_to(np.arange(len(scale))[:, np.newaxis], nearest.shape)
+        is_hit = np.zeros((len(scale), len(line)), dtype=np.bool_)
+        is_hit[rows[is_matched], nearest[is_matched]] = True
+
+        before = np.maximum.accumulate(np.where(is_hit, indexes, -1), axis=1)
+        after = np.minimum.accumulate(np.where(is_hit, indexes, len(line))[:, ::-1], axis=1)[:, ::-1]
+        is_inside = (before >= firsts) & (after <= lasts) | grounds
+        scores[start: start + step] -= ((is_inside & is_narrow & ~is_hit) * penalties).sum(axis=1)
+
+    return scores
+
+
+def refine(channels: np.ndarray, significances: np.ndarray, theory: np.ndarray,
+           guess: tuple[float, float], tolerance: float, degree: int = 1) -> CalibrationResult:
+    '''
+    Matches candidates to theory under guessed calibration and refines
+    it by weighted least squares polynomial of given degree.
+    '''
+    scale_value, scale_shift = guess
+    found, states = match_to_theory(scale_value * channels + scale_shift, theory, tolerance * scale_value)
+    if len(found) < degree + 1:
+        raise RuntimeError(f'Only {len(found)} peaks were matched, {degree + 1} needed for calibration.')
+
+    matched, energies = channels[found], np.asarray(theory)[states]
+    weights = significances[found] ** 2
+
+    coefficients, covariance = weighted_polyfit(matched, energies, weights, degree)
+    return CalibrationResult(coefficients, matched, energies, weights, states, covariance)
+
+
+def weighted_polyfit(channels: np.ndarray, energies: np.ndarray, weights: np.ndarray,
+                     degree: int) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Weighted least squares polynomial and covariance of its coefficients.
+    Weights are relative, so covariance is scaled by weighted residual
+    variance; it is NaN when there are no spare degrees of freedom.
+    '''
+    design = channels[:, np.newaxis] ** np.arange(degree + 1)
+    root = np.sqrt(weights)
+    weighted_design = design * root[:, np.newaxis]
+    coefficients = np.linalg.lstsq(weighted_design, energies * root, rcond=None)[0]
+
+    freedom = len(channels) - (degree + 1)
+    if freedom <= 0:
+        return (coefficients, np.full((degree + 1, degree + 1), np.nan))
+
+    variance = (weights * (energies - design @ coefficients) ** 2).sum() / freedom
+    return (coefficients, np.linalg.pinv(weighted_design.T @ weighted_design) * variance)
+
+
+def auto_calibrate(spectrum: np.ndarray, theory: list[float], fwhm: float = 10, degree: int = 1,
+                   tolerance: float = None, threshold: float = 3.0,
+                   scale_range: tuple[float, float] = (0, np.inf), widths: list[float] = None) -> CalibrationResult:
+    '''
+    Automatic calibration of spectrum by theory peak energies.\n
+    fwhm and tolerance are in channels (tolerance defaults to one fwhm).
+    Widths are wigner widths of theory levels in MeV, if known.
+    Raises RuntimeError when calibration is ambiguous or implausible.
+    '''
+    theory = np.asarray(theory, dtype=np.float64)
+    valid = np.flatnonzero(np.isfinite(theory))
+    theory = theory[valid]
+    widths = None if widths is None else np.asarray(widths, dtype=np.float64)[valid]
+    if len(theory) < 2:
+        raise RuntimeError('At least two theory peaks are needed for calibration.')
+
+    tolerance = fwhm if tolerance is None else tolerance
+    channels, significances = candidate_peaks(spectrum, fwhm, threshold, count=3 * len(theory))
+    if len(channels) < 2:
+        raise RuntimeError('Less than two peaks were found in spectrum.')
+
+    guess = pattern_search(channels, significances, theory, tolerance, scale_range, widths)
+    result = refine(channels, significances, theory, guess, tolerance, 1)
+    if degree > 1:
+        result = refine(channels, significances, theory, (result.scale_value, result.scale_shift),
+                        tolerance, degree)
+
+    result.states = valid[result.states]
+    return check_calibration(result, tolerance)
+
+
+def global_calibrate(spectres: list[np.ndarray], angles: list[float], reaction: Reaction, fwhm: float = 10,
+                     degree: int = 1, tolerance: float = None, threshold: float = 3.0,
+                     scale_range: tuple[float, float] = (0, np.inf)) -> GlobalCalibrationResult:
+    '''
+    Fits one detector calibration to spectres of all angles at once.
+    Theory energies of every angle come from reaction kinematics.
+    Candidates of all angles are pooled and placed on one energy line,
+    each angle shifted by a large offset, so matching and least squares
+    over the whole run are single array operations.
+    Hypotheses come from the angle with the most significant peaks
+    and are bounded as in pattern_search.
+    '''
+    angles = np.asarray(angles, dtype=np.float64)
+    tolerance = fwhm if tolerance is None else tolerance
+
+    theory = reaction.kinematics(reaction.residual.states, angles).fragment_energy.T
+    finite = theory[np.isfinite(theory)]
+    if len(finite) < 2:
+        raise RuntimeError('At least two theory peaks are needed for calibration.')
+    spacing = 10 * (finite.max() - finite.min() + 1)
+
+    channels, significances, owners = [], [], []
+    for i, spectrum in enumerate(spectres):
+        spectrum = np.asarray(spectrum)[:zero_run_cutoff(spectrum)]
+        found, significance = candidate_peaks(spectrum, fwhm, threshold, count=3 * theory.shape[1])
+
+        channels.append(found)
+        significances.append(significance)
+        owners.append(np.full(len(found), i))
+
+    channels, significances = np.concatenate(channels), np.concatenate(significances)
+    owners = np.concatenate(owners)
+    if len(channels) < 2:
+        raise RuntimeError('Less than two peaks were found in spectres.')
+
+    offsets = np.arange(len(angles))[:, np.newaxis] * spacing
+    line = (theory + offsets).ravel()
+    is_valid = np.isfinite(line)
+    levels, line = np.flatnonzero(is_valid), line[is_valid]
+    order = np.argsort(line)
+    levels, line = levels[order], line[order]
+
+    strongest = int(np.bincount(owners, weights=significances, minlength=len(angles)).argmax())
+    own = owners == strongest
+    anchors = strongest_channels(channels[own], significances[own], PATTERN_CANDIDATES)
+    scales, shifts = hypotheses(anchors, pattern_levels(theory[strongest]), scale_range)
+
+    penalties, grounds = level_penalties(len(line), significances, levels % theory.shape[1] == 0)
+    widths = np.asarray(reaction.residual.wigner_widths, dtype=np.float64)[levels % theory.shape[1]]
+    def rescored(scales: np.ndarray, shifts: np.ndarray) -> np.ndarray:
+        return score_hypotheses(scales, shifts, channels, significances, line, tolerance, owners * spacing,
+                                penalties, grounds, widths, levels // theory.shape[1])
+
+    def refined(guess: tuple[float, float]) -> GlobalCalibrationResult:
+        pooled = guess[0] * channels + guess[1] + owners * spacing
+        return refine_pooled(channels, significances, owners, line, pooled, tolerance * guess[0], spacing, 1)
+
+    guess = best_hypothesis(scales, shifts, rescored(scales, shifts), tolerance, channels, refined, rescored)
+
+    for current in range(1, degree + 1):
+        pooled = guess[0] * channels + guess[1] + owners * spacing
+        result = refine_pooled(channels, significances, owners, line, pooled, tolerance * guess[0], spacing, current)
+        guess = (result.scale_value, result.scale_shift)
+
+    result.states = levels[result.states] % theory.shape[1]
+    result.angles = angles[result.angles]
+    return check_calibration(result, tolerance)
+
+
+def hypotheses(channels: np.ndarray, theory: np.ndarray,
+               scale_range: tuple[float, float] = (0, np.inf)) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Linear calibrations mapping pair of channels onto pair of energies.
+    Only neighbouring pairs are taken: every channel with its next
+    CANDIDATE_REACH channels and every level with its next LEVEL_REACH
+    levels, so number of hypotheses grows linearly with both.
+    '''
+    channels, theory = np.sort(channels), np.sort(theory)
+    first, second = neighbour_pairs(len(channels), CANDIDATE_REACH)
+    low, high = neighbour_pairs(len(theory), LEVEL_REACH)
+    if len(first) == 0 or len(low) == 0:
+        raise RuntimeError('Can not find any calibration hypothesis for these peaks.')
+
+    scales = (theory[high][np.newaxis, :] - theory[low][np.newaxis, :]) / \
+        (channels[second][:, np.newaxis] - channels[first][:, np.newaxis])
+    shifts = theory[low][np.newaxis, :] - scales * channels[first][:, np.newaxis]
+
+    scales, shifts = scales.ravel(), shifts.ravel()
+    is_allowed = (scales > scale_range[0]) & (scales < scale_range[1])
+    if not is_allowed.any():
+        raise RuntimeError('Can not find any calibration hypothesis for these peaks.')
+
+    return (scales[is_allowed], shifts[is_allowed])
+
+
+def refine_pooled(channels: np.ndarray, significances: np.ndarray, owners: np.ndarray, line: np.ndarray,
+                  pooled: np.ndarray, tolerance: float, spacing: float, degree: int) -> GlobalCalibrationResult:
+    found, states = match_to_theory(pooled, line, tolerance)
+    if len(found) < degree + 1:
+        raise RuntimeError(f'Only {len(found)} peaks were matched, {degree + 1} needed for calibration.')
+
+    matched = channels[found]
+    energies = line[states] - owners[found] * spacing
+    weights = significances[found] ** 2
+
+    coefficients, covariance = weighted_polyfit(matched, energies, weights, degree)
+    return GlobalCalibrationResult(coefficients, matched, energies, weights, states, owners[found], covariance)
+
+
+def calibrate_directory(sleuth: Sleuth, reaction: Reaction, fwhm: float = 10, degree: int = 1,
+                        tolerance: float = None, threshold: float = 3.0) -> GlobalCalibrationResult:
+    angles = sorted(sleuth.angles)
+    spectres = [sleuth.to_spectrum(angle) for angle in angles]
+    return global_calibrate(spectres, angles, reaction, fwhm, degree, tolerance, threshold)
+
+
+if __name__ == '__main__':
+    pass
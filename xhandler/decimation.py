@@ -0,0 +1,74 @@
+import numpy as np
+
+
+class DecimationPyramid:
+    '''
+    Min/max decimation levels of spectrum, built once.
+    Level k keeps for every block of 2^k channels indexes of its minimum
+    and maximum, so narrow peaks survive any zoom out. Query returns
+    about two points per pixel of visible range, its cost depends on
+    number of pixels, not on number of channels. xs must be ascending.
+    '''
+    def __init__(self, xs: np.ndarray, ys: np.ndarray) -> None:
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys)
+        self.levels: list[tuple[np.ndarray, np.ndarray]] = []
+
+        lows = highs = np.arange(len(self.ys))
+        while len(lows) > 1:
+            lows, highs = self.__halve(lows, highs)
+            self.levels.append((lows, highs))
+
+    def __len__(self) -> int:
+        return len(self.ys)
+
+    def __halve(self, lows: np.ndarray, highs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if len(lows) % 2 == 1:
+            lows, highs = np.append(lows, lows[-1]), np.append(highs, highs[-1])
+
+        left_lows, right_lows = lows[0::2], lows[1::2]
+        left_highs, right_highs = highs[0::2], highs[1::2]
+
+        lows = np.where(self.ys[right_lows] < self.ys[left_lows], right_lows, left_lows)
+        highs = np.where(self.ys[right_highs] > self.ys[left_highs], right_highs, left_highs)
+        return (lows, highs)
+
+    def level_for(self, count: int, buckets: int) -> int:
+        '''
+        Smallest level at which `count` channels fit into `buckets` blocks.
+        '''
+        if count <= 2 * buckets:
+            return 0
+        return min(int(np.ceil(np.log2(count / buckets))), len(self.levels))
+
+    def query(self, low: float, high: float, buckets: int) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Decimated points of range [low, high] with one neighbour channel
+        on each side, so the line runs to the axes edges.
+        '''
+        start = max(int(np.searchsorted(self.xs, low, side='left')) - 1, 0)
+        stop = min(int(np.searchsorted(self.xs, high, side='right')) + 1, len(self))
+        if stop <= start:
+            return (self.xs[:0], self.ys[:0])
+
+        level = self.level_for(stop - start, max(buckets, 1))
+        if level == 0:
+            return (self.xs[start: stop], self.ys[start: stop])
+
+        lows, highs = self.levels[level - 1]
+        first, last = start >> level, ((stop - 1) >> level) + 1
+        lows, highs = lows[first: last], highs[first: last]
+
+        indexes = np.empty(2 * len(lows), dtype=np.int64)
+        indexes[0::2] = np.minimum(lows, highs)
+        indexes[1::2] = np.maximum(lows, highs)
+        return (self.xs[indexes], self.ys[indexes])
+
+    def full(self, buckets: int) -> tuple[np.ndarray, np.ndarray]:
+        if len(self) == 0:
+            return (self.xs, self.ys)
+        return self.query(self.xs[0], self.xs[-1], buckets)
+
+
+if __name__ == '__main__':
+    pass
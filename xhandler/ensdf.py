@@ -1,14 +1,14 @@
 from __future__ import annotations
-import os
+import os, re, tempfile
+import numpy as np
 
 
 NAME2CHARGE = {
-    'p' :   1, 'd' :   1, 't' :   1,
     'h' :   1, 'he':   2, 'li':   3, 'be':   4, 'b' :   5, 'c' :   6,
     'n' :   7, 'o' :   8, 'f' :   9, 'ne':  10, 'na':  11, 'mg':  12,
     'al':  13, 'si':  14, 'p' :  15, 's' :  16, 'cl':  17, 'ar':  18,
     'k' :  19, 'ca':  20, 'sc':  21, 'ti':  22, 'v' :  23, 'cr':  24,
-    'mn':  25, 'fe':  26, 'co':  27, 'ni':  28, 'cu':  29, 'zr':  30,
+    'mn':  25, 'fe':  26, 'co':  27, 'ni':  28, 'cu':  29, 'zn':  30,
     'ga':  31, 'ge':  32, 'as':  33, 'se':  34, 'br':  35, 'kr':  36,
     'rb':  37, 'sr':  38, 'y' :  39, 'zr':  40, 'nb':  41, 'mo':  42,
     'tc':  43, 'ru':  44, 'rh':  45, 'pd':  46, 'ag':  47, 'cd':  48,
@@ -33,7 +33,7 @@ CHARGE2NAME = {
     7  :  'N', 8  :  'O', 9  :  'F', 10 : 'Ne', 11 : 'Na', 12 : 'Mg',
     13 : 'Al', 14 : 'Si', 15 :  'P', 16 :  'S', 17 : 'Cl', 18 : 'Ar',
     19 :  'K', 20 : 'Ca', 21 : 'Sc', 22 : 'Ti', 23 :  'V', 24 : 'Cr',
-    25 : 'Mn', 26 : 'Fe', 27 : 'Co', 28 : 'Ni', 29 : 'Cu', 30 : 'Zr',
+    25 : 'Mn', 26 : 'Fe', 27 : 'Co', 28 : 'Ni', 29 : 'Cu', 30 : 'Zn',
     31 : 'Ga', 32 : 'Ge', 33 : 'As', 34 : 'Se', 35 : 'Br', 36 : 'Kr',
     37 : 'Rb', 38 : 'Sr', 39 :  'Y', 40 : 'Zr', 41 : 'Nb', 42 : 'Mo',
     43 : 'Tc', 44 : 'Ru', 45 : 'Rh', 46 : 'Pd', 47 : 'Ag', 48 : 'Cd',
@@ -58,46 +58,290 @@ ENERGY_SIZE = 10
 PARITY_SIZE = 10
 GAMMA_SIZE = 10
 
+ENSDF_PATH = './ensdf/'
+COMPILED_NAME = 'ensdf.bin'
+SOURCE_FILE = re.compile(r'^(\d+)([A-Za-z]+)\.txt$')
 
-def mass_excess_of(z: int, a: int) -> float:
-    file = open(find_file(z), 'r').read().split('\n')
-    start, _ = find_nuclei_area(z, a, file)
-
-    return get_mass_excess(file[start])
-
-def excitation_energies(z: int, a: int) -> list[float]:
-    file = open(find_file(z), 'r').read().split('\n')
-    start, stop = find_nuclei_area(z, a, file)
 
+class NuclideRecord:
+    '''
+    Parsed ENSDF data of one nuclei held in compact arrays.
+    '''
+    __slots__ = ('z', 'a', 'mass_excess', 'energies', 'spins', 'parities', 'widths')
+
+    def __init__(self, z: int, a: int, mass_excess: float, energies: np.ndarray,
+                 spins: np.ndarray, parities: np.ndarray, widths: np.ndarray) -> None:
+        self.z = z
+        self.a = a
+        self.mass_excess = mass_excess
+
+        self.energies = energies
+        self.spins = spins
+        self.parities = parities
+        self.widths = widths
+
+    @staticmethod
+    def from_lines(z: int, a: int, lines: list[str]) -> NuclideRecord:
+        levels = lines[1:]
+
+        energies = np.array([get_energy(line) for line in levels], dtype=np.float64)
+        spins_parities = [get_spin_parity(line) for line in levels]
+        spins = np.array([spin for spin, _ in spins_parities], dtype=np.float64)
+        parities = np.array([parity for _, parity in spins_parities], dtype=np.bool_)
+        widths = np.array([get_gamma(line) for line in levels], dtype=np.float64)
+
+        return NuclideRecord(z, a, get_mass_excess(lines[0]), energies, spins, parities, widths)
+
+
+class EnsdfDatabase:
+    '''
+    In-memory ENSDF store. Every element file is read once, split
+    into nuclei areas and indexed by (z, a). Areas are parsed
+    into NuclideRecord on first request.
+    '''
+    def __init__(self, ensdf_path: str = ENSDF_PATH, use_compiled: bool = True) -> None:
+        self.ensdf_path = ensdf_path
+        self.use_compiled = use_compiled
+
+        self.__records: dict[tuple[int, int], NuclideRecord] = {}
+        self.__areas: dict[tuple[int, int], list[str]] = {}
+        self.__loaded: set[int] = set()
+
+        self.__compiled: CompiledEnsdf | None = None
+        self.__is_compiled_checked = False
+
+    @property
+    def compiled(self) -> CompiledEnsdf | None:
+        if not self.use_compiled:
+            return None
+
+        if not self.__is_compiled_checked:
+            self.__is_compiled_checked = True
+            try:
+                self.__compiled = CompiledEnsdf.open(self.ensdf_path)
+            except (OSError, ValueError):
+                self.__compiled = None
+
+        return self.__compiled
+
+    def record(self, z: int, a: int) -> NuclideRecord:
+        key = (z, a)
+        if key in self.__records:
+            return self.__records[key]
+
+        if self.compiled is not None:
+            record = self.compiled.record(z, a)
+            self.__records[key] = record
+            return record
+
+        self.load_element(z)
+        if key not in self.__areas:
+            raise ValueError(f'Cannot find nuclei with z: {z} and a: {a}')
+
+        record = NuclideRecord.from_lines(z, a, self.__areas.pop(key))
+        self.__records[key] = record
+        return record
+
+    def load_element(self, z: int) -> None:
+        if z in self.__loaded:
+            return
+
+        file = open(find_file(z, self.ensdf_path), 'r').read().split('\n')
+        for a, (start, stop) in split_nuclei_areas(z, file).items():
+            self.__areas[(z, a)] = file[start: stop]
+
+        self.__loaded.add(z)
+
+    def clear(self) -> None:
+        self.__records.clear()
+        self.__areas.clear()
+        self.__loaded.clear()
+
+        self.__compiled = None
+        self.__is_compiled_checked = False
+
+
+class CompiledEnsdf:
+    '''
+    Binary image of the whole ensdf directory loaded through numpy.memmap.\n
+    File layout (all parts are contiguous):\n
+    header | sources table | nuclides table | energies | spins | widths | parities\n
+    Sources table keeps (z, mtime, size) of every text file, so the image
+    is rebuilt automatically when any of them changes.
+    '''
+    MAGIC = int.from_bytes(b'ENSDF', 'little')
+    VERSION = 1
+
+    HEADER_DTYPE = np.dtype([
+        ('magic', '<i8'), ('version', '<i8'), ('files', '<i8'), ('nuclides', '<i8'), ('levels', '<i8')
+    ])
+    SOURCE_DTYPE = np.dtype([('z', '<i8'), ('mtime', '<i8'), ('size', '<i8')])
+    NUCLIDE_DTYPE = np.dtype([
+        ('z', '<i4'), ('a', '<i4'), ('mass_excess', '<f8'), ('start', '<i8'), ('count', '<i8')
+    ])
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        header = np.fromfile(path, dtype=CompiledEnsdf.HEADER_DTYPE, count=1)
+        if len(header) == 0 or header['magic'][0] != CompiledEnsdf.MAGIC \
+            or header['version'][0] != CompiledEnsdf.VERSION:
+            raise ValueError(f'{path} is not a compiled ensdf database')
+
+        files, nuclides, levels = int(header['files'][0]), int(header['nuclides'][0]), int(header['levels'][0])
+
+        offset = CompiledEnsdf.HEADER_DTYPE.itemsize
+        self.sources = self.__map(CompiledEnsdf.SOURCE_DTYPE, offset, files)
+        offset += CompiledEnsdf.SOURCE_DTYPE.itemsize * files
+
+        self.nuclides = self.__map(CompiledEnsdf.NUCLIDE_DTYPE, offset, nuclides)
+        offset += CompiledEnsdf.NUCLIDE_DTYPE.itemsize * nuclides
+
+        self.energies = self.__map(np.dtype('<f8'), offset, levels)
+        offset += 8 * levels
+        self.spins = self.__map(np.dtype('<f8'), offset, levels)
+        offset += 8 * levels
+        self.widths = self.__map(np.dtype('<f8'), offset, levels)
+        offset += 8 * levels
+        self.parities = self.__map(np.dtype('u1'), offset, levels).view(np.bool_)
+
+        self.index = {
+            (int(z), int(a)): i for i, (z, a) in enumerate(zip(self.nuclides['z'], self.nuclides['a']))
+        }
+
+    def __map(self, dtype: np.dtype, offset: int, count: int) -> np.ndarray:
+        if count == 0:
+            return np.empty(0, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=(count,))
+
+    def record(self, z: int, a: int) -> NuclideRecord:
+        if (z, a) not in self.index:
+            raise ValueError(f'Cannot find nuclei with z: {z} and a: {a}')
+
+        row = self.nuclides[self.index[(z, a)]]
+        start, stop = int(row['start']), int(row['start'] + row['count'])
+
+        return NuclideRecord(
+            z, a, float(row['mass_excess']),
+            self.energies[start: stop], self.spins[start: stop],
+            self.parities[start: stop], self.widths[start: stop]
+        )
+
+    def is_fresh(self, ensdf_path: str) -> bool:
+        current = source_table(ensdf_path)
+        return len(current) == len(self.sources) and bool(np.all(current == np.asarray(self.sources)))
+
+    @staticmethod
+    def open(ensdf_path: str = ENSDF_PATH) -> CompiledEnsdf:
+        '''
+        Opens compiled database of directory, rebuilding it when
+        it is absent or older than the ensdf text files.
+        '''
+        path = os.path.join(ensdf_path, COMPILED_NAME)
+        if os.path.exists(path):
+            try:
+                compiled = CompiledEnsdf(path)
+                if compiled.is_fresh(ensdf_path):
+                    return compiled
+            except ValueError:
+                pass
+
+        return CompiledEnsdf(compile_database(ensdf_path))
+
+
+def source_table(ensdf_path: str = ENSDF_PATH) -> np.ndarray:
     collected = []
-    for i in range(start + 1, stop):
-        collected.append(get_energy(file[i]))
+    for file in os.listdir(ensdf_path):
+        found = SOURCE_FILE.match(file)
+        if found is None:
+            continue
+
+        stat = os.stat(os.path.join(ensdf_path, file))
+        collected.append((int(found.group(1)), stat.st_mtime_ns, stat.st_size))
+
+    return np.array(sorted(collected), dtype=CompiledEnsdf.SOURCE_DTYPE)
+
+def compile_database(ensdf_path: str = ENSDF_PATH) -> str:
+    '''
+    Build step which turns every element file of ensdf directory
+    into one binary file. Nuclei with unparsable areas are skipped.
+    Image is written to a unique temporary file and moved into place,
+    so concurrent builds never see each other's partial files.
+    Returns path of the compiled file.
+    '''
+    sources = source_table(ensdf_path)
+
+    records: list[NuclideRecord] = []
+    for z in sources['z']:
+        z = int(z)
+        if z not in CHARGE2NAME:
+            continue
+
+        file = open(os.path.join(ensdf_path, f'{z}{CHARGE2NAME[z]}.txt'), 'r').read().split('\n')
+        areas = split_nuclei_areas(z, file)
+        for a in sorted(areas):
+            start, stop = areas[a]
+            try:
+                records.append(NuclideRecord.from_lines(z, a, file[start: stop]))
+            except (ValueError, IndexError):
+                continue
+
+    counts = np.array([len(record.energies) for record in records], dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1])) if len(records) else counts
+
+    nuclides = np.zeros(len(records), dtype=CompiledEnsdf.NUCLIDE_DTYPE)
+    nuclides['z'] = [record.z for record in records]
+    nuclides['a'] = [record.a for record in records]
+    nuclides['mass_excess'] = [record.mass_excess for record in records]
+    nuclides['start'] = starts
+    nuclides['count'] = counts
+
+    def joined(name: str, dtype: str) -> np.ndarray:
+        if not records:
+            return np.empty(0, dtype=dtype)
+        return np.concatenate([getattr(record, name) for record in records]).astype(dtype)
+
+    header = np.zeros(1, dtype=CompiledEnsdf.HEADER_DTYPE)
+    header['magic'] = CompiledEnsdf.MAGIC
+    header['version'] = CompiledEnsdf.VERSION
+    header['files'] = len(sources)
+    header['nuclides'] = len(records)
+    header['levels'] = int(counts.sum())
+
+    path = os.path.join(ensdf_path, COMPILED_NAME)
+    descriptor, temporary = tempfile.mkstemp(prefix=COMPILED_NAME, suffix='.tmp', dir=ensdf_path)
+    try:
+        with os.fdopen(descriptor, 'wb') as file:
+            for part in [header, sources, nuclides, joined('energies', '<f8'), joined('spins', '<f8'),
+                         joined('widths', '<f8'), joined('parities', 'u1')]:
+                file.write(part.tobytes())
+
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+    return path
+
+
+DATABASE = EnsdfDatabase()
 
-    return collected
 
-def spin_parity(z: int, a: int) -> list[tuple[float, bool]]:
-    file = open(find_file(z), 'r').read().split('\n')
-    start, stop = find_nuclei_area(z, a, file)
+def mass_excess_of(z: int, a: int) -> float:
+    return DATABASE.record(z, a).mass_excess
 
-    collected = []
-    for i in range(start + 1, stop):
-        collected.append(get_spin_parity(file[i]))
+def excitation_energies(z: int, a: int) -> list[float]:
+    return DATABASE.record(z, a).energies.tolist()
 
-    return collected
+def spin_parity(z: int, a: int) -> list[tuple[float, bool]]:
+    record = DATABASE.record(z, a)
+    return list(zip(record.spins.tolist(), record.parities.tolist()))
 
 def gammas(z: int, a: int) -> list[float]:
-    file = open(find_file(z), 'r').read().split('\n')
-    start, stop = find_nuclei_area(z, a, file)
-
-    collected = []
-    for i in range(start + 1, stop):
-        collected.append(get_gamma(file[i]))
-
-    return collected
+    return DATABASE.record(z, a).widths.tolist()
 
 
-def find_file(z: int) -> str:
-    ensdf_path = './ensdf/'
+def find_file(z: int, ensdf_path: str = ENSDF_PATH) -> str:
     files = os.listdir(ensdf_path)
 
     choosen = CHARGE2NAME[z]
@@ -127,6 +371,32 @@ def find_nuclei_area(z: int, a: int, buffer: list[str]) -> tuple[int, int]:
     if not is_opened:
         raise ValueError(f'Cannot find nuclei with z: {z} and a: {a}')
 
+    return (start, len(buffer))
+
+def split_nuclei_areas(z: int, buffer: list[str]) -> dict[int, tuple[int, int]]:
+    '''
+    Single pass version of find_nuclei_area. Returns areas
+    of all nuclei inside element file keyed by mass number.
+    '''
+    choosen = CHARGE2NAME[z].upper()
+    label = re.compile(rf'(?<!\d)(\d+){choosen}(?![A-Z])')
+
+    areas = {}
+    current, start = None, 0
+    for i in range(len(buffer)):
+        found = label.search(buffer[i])
+        pretend = int(found.group(1)) if found else None
+
+        if pretend != current:
+            if current is not None and current not in areas:
+                areas[current] = (start, i)
+            current, start = pretend, i
+
+    if current is not None and current not in areas:
+        areas[current] = (start, len(buffer))
+
+    return areas
+
 def get_mass_excess(line: str) -> float:
     mass_excess_flag = 'deltaM='
     if mass_excess_flag not in line:
@@ -167,4 +437,4 @@ def get_gamma(line: str) -> float:
 
 
 if __name__ == '__main__':
-    pass
+    print(f'Compiled ensdf database: {compile_database()}')
@@ -0,0 +1,376 @@
+import numpy as np
+
+
+FWHM_TO_SIGMA = 1 / (2 * np.sqrt(2 * np.log(2)))
+PEAK_PARAMETERS = ('mu', 'fwhm', 'area')
+
+
+class FitResult:
+    '''
+    Parameters of fitted multiplet. Covariance is (parameters x parameters)
+    matrix in fitter order: (mu, fwhm, area) of every peak, then background
+    coefficients. Rows and columns of fixed parameters are zero.
+    Free parameters which ended on their bound are flagged in at_bounds,
+    their rows and columns are NaN, since fit did not determine them.
+    When curvature at minimum is not positive definite (degenerate
+    components) is_definite is False and whole covariance is NaN.
+    '''
+    def __init__(self, mus: np.ndarray, fwhms: np.ndarray, areas: np.ndarray, background: np.ndarray,
+                 chi_square: float, iterations: int, is_converged: bool,
+                 covariance: np.ndarray = None, degrees_of_freedom: int = 0,
+                 at_bounds: np.ndarray = None, is_definite: bool = True) -> None:
+        self.mus = mus
+        self.fwhms = fwhms
+        self.areas = areas
+        self.background = background
+
+        self.chi_square = chi_square
+        self.iterations = iterations
+        self.is_converged = is_converged
+
+        size = 3 * len(mus) + len(background)
+        self.covariance = np.full((size, size), np.nan) if covariance is None else covariance
+        self.degrees_of_freedom = degrees_of_freedom
+        self.at_bounds = np.zeros(size, dtype=np.bool_) if at_bounds is None else at_bounds
+        self.is_definite = is_definite
+
+    def __len__(self) -> int:
+        return len(self.mus)
+
+    @property
+    def reduced_chi_square(self) -> float:
+        return self.chi_square / self.degrees_of_freedom if self.degrees_of_freedom > 0 else np.nan
+
+    @property
+    def errors(self) -> np.ndarray:
+        return np.sqrt(np.diag(self.covariance))
+
+    @property
+    def mu_errors(self) -> np.ndarray:
+        return self.errors[0: 3 * len(self): 3]
+
+    @property
+    def fwhm_errors(self) -> np.ndarray:
+        return self.errors[1: 3 * len(self): 3]
+
+    @property
+    def area_errors(self) -> np.ndarray:
+        return self.errors[2: 3 * len(self): 3]
+
+    @property
+    def background_errors(self) -> np.ndarray:
+        return self.errors[3 * len(self):]
+
+    @property
+    def mu_at_bounds(self) -> np.ndarray:
+        return self.at_bounds[0: 3 * len(self): 3]
+
+    @property
+    def is_bounded(self) -> bool:
+        return bool(self.at_bounds.any())
+
+    @property
+    def correlation(self) -> np.ndarray:
+        errors = self.errors
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return self.covariance / np.outer(errors, errors)
+
+    def peak_covariance(self, peak: int) -> np.ndarray:
+        '''
+        3 x 3 covariance of (mu, fwhm, area) of one peak.
+        '''
+        return self.covariance[3 * peak: 3 * peak + 3, 3 * peak: 3 * peak + 3]
+
+
+class MultipletFitter:
+    '''
+    Simultaneous least-squares fit of several gaussian peaks on a
+    polynomial background. Minimization is done by Levenberg-Marquardt
+    with analytic jacobian, data is weighted by poisson errors.\n
+    Parameters of every peak (mu, fwhm, area) can be fixed or bounded.\n
+    Every peak is evaluated only inside its window of window_factor * fwhm
+    (default is full width at tenth maximum, as PeakSupervisor.width does).
+    x_data must be sorted ascending.
+    '''
+    def __init__(self, x_data: np.ndarray, y_data: np.ndarray, centers: np.ndarray, fwhms: np.ndarray,
+                 areas: np.ndarray = None, background_degree: int = 1,
+                 window_factor: float = 1 / np.log10(2)) -> None:
+        self.window_factor = window_factor
+        self.x_data = np.asarray(x_data, dtype=np.float64)
+        self.y_data = np.asarray(y_data, dtype=np.float64)
+        self.weights = 1 / np.maximum(self.y_data, 1)
+
+        self.peaks_count = len(centers)
+        self.background_degree = background_degree
+        self.origin = (self.x_data[0] + self.x_data[-1]) / 2
+
+        if areas is None:
+            areas = self.__guess_areas(np.asarray(centers, dtype=np.float64), np.asarray(fwhms, dtype=np.float64))
+
+        self.parameters = np.concatenate((
+            np.column_stack((centers, fwhms, areas)).astype(np.float64).ravel(),
+            np.zeros(background_degree + 1)
+        ))
+        self.parameters[-(background_degree + 1)] = max(np.median(self.y_data), 0)
+
+        step = np.abs(self.x_data[-1] - self.x_data[0]) / max(len(self.x_data) - 1, 1)
+        self.lower = np.full(len(self.parameters), -np.inf)
+        self.upper = np.full(len(self.parameters), np.inf)
+        self.lower[0: 3 * self.peaks_count: 3] = self.x_data.min()
+        self.upper[0: 3 * self.peaks_count: 3] = self.x_data.max()
+        self.lower[1: 3 * self.peaks_count: 3] = step
+        self.upper[1: 3 * self.peaks_count: 3] = max(self.x_data.max() - self.x_data.min(), step)
+        self.lower[2: 3 * self.peaks_count: 3] = 1e-12
+
+        self.is_free = np.ones(len(self.parameters), dtype=np.bool_)
+        self.parameters = np.clip(self.parameters, self.lower, self.upper)
+
+    def __guess_areas(self, centers: np.ndarray, fwhms: np.ndarray) -> np.ndarray:
+        indexes = np.abs(self.x_data[np.newaxis, :] - centers[:, np.newaxis]).argmin(axis=1)
+        heights = np.maximum(self.y_data[indexes], 1)
+        return heights * fwhms * np.sqrt(np.pi / (4 * np.log(2)))
+
+    def __index(self, peak: int, name: str) -> int:
+        if name not in PEAK_PARAMETERS:
+            raise ValueError(f'Unknown peak parameter: {name}')
+        return 3 * peak + PEAK_PARAMETERS.index(name)
+
+    def fix(self, peak: int, name: str, value: float = None) -> None:
+        index = self.__index(peak, name)
+        if value is not None:
+            self.parameters[index] = value
+        self.is_free[index] = False
+
+    def release(self, peak: int, name: str) -> None:
+        self.is_free[self.__index(peak, name)] = True
+
+    def bound(self, peak: int, name: str, lower: float = -np.inf, upper: float = np.inf) -> None:
+        index = self.__index(peak, name)
+        self.lower[index], self.upper[index] = lower, upper
+        self.parameters[index] = np.clip(self.parameters[index], lower, upper)
+
+    def background(self, parameters: np.ndarray = None) -> np.ndarray:
+        parameters = self.parameters if parameters is None else parameters
+        coefficients = parameters[3 * self.peaks_count:]
+        return np.polynomial.polynomial.polyval(self.x_data - self.origin, coefficients)
+
+    def windows(self, parameters: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Channel ranges [start, stop) where every peak is evaluated.
+        Width of window is window_factor * fwhm around the center.
+        '''
+        parameters = self.parameters if parameters is None else parameters
+        peaks = parameters[:3 * self.peaks_count].reshape(-1, 3)
+        halfs = peaks[:, 1] * self.window_factor / 2
+
+        starts = np.searchsorted(self.x_data, peaks[:, 0] - halfs, side='left')
+        stops = np.searchsorted(self.x_data, peaks[:, 0] + halfs, side='right')
+        return (starts, stops)
+
+    def __evaluate(self, parameters: np.ndarray, with_derivatives: bool) -> tuple:
+        '''
+        Evaluates gaussians only inside their windows. Returns flattened
+        window entries: channel indexes, owner peaks, windows, gaussian
+        values and (entries x 3) derivatives by mu, fwhm, area.
+        '''
+        peaks = parameters[:3 * self.peaks_count].reshape(-1, 3)
+        starts, stops = self.windows(parameters)
+        lengths = stops - starts
+
+        owners = np.repeat(np.arange(self.peaks_count), lengths)
+        offsets = np.cumsum(lengths) - lengths
+        rows = np.arange(lengths.sum()) - np.repeat(offsets, lengths) + np.repeat(starts, lengths)
+
+        mus, sigmas, areas = peaks[owners, 0], peaks[owners, 1] * FWHM_TO_SIGMA, peaks[owners, 2]
+        distance = self.x_data[rows] - mus
+        shapes = np.exp(-distance ** 2 / (2 * sigmas ** 2)) / (sigmas * np.sqrt(2 * np.pi))
+        gaussians = areas * shapes
+
+        if not with_derivatives:
+            return (rows, owners, starts, stops, gaussians, None)
+
+        derivatives = np.empty((len(rows), 3))
+        derivatives[:, 0] = gaussians * distance / sigmas ** 2
+        derivatives[:, 1] = gaussians * (distance ** 2 / sigmas ** 3 - 1 / sigmas) * FWHM_TO_SIGMA
+        derivatives[:, 2] = shapes
+
+        return (rows, owners, starts, stops, gaussians, derivatives)
+
+    def __powers(self) -> np.ndarray:
+        return (self.x_data - self.origin)[:, np.newaxis] ** np.arange(self.background_degree + 1)
+
+    def components(self, parameters: np.ndarray = None) -> np.ndarray:
+        '''
+        Returns (peaks x channels) matrix of every gaussian of multiplet.
+        '''
+        parameters = self.parameters if parameters is None else parameters
+        rows, owners, _, _, gaussians, _ = self.__evaluate(parameters, False)
+
+        components = np.zeros((self.peaks_count, len(self.x_data)))
+        components[owners, rows] = gaussians
+        return components
+
+    def model(self, parameters: np.ndarray = None) -> np.ndarray:
+        parameters = self.parameters if parameters is None else parameters
+        rows, _, _, _, gaussians, _ = self.__evaluate(parameters, False)
+
+        return np.bincount(rows, weights=gaussians, minlength=len(self.x_data)) + self.background(parameters)
+
+    def jacobian(self, parameters: np.ndarray = None) -> np.ndarray:
+        '''
+        Analytic derivatives of model by every parameter: (channels x parameters).
+        Dense form of the windowed jacobian, fit itself never builds it.
+        '''
+        parameters = self.parameters if parameters is None else parameters
+        rows, owners, _, _, _, derivatives = self.__evaluate(parameters, True)
+
+        jacobian = np.zeros((len(self.x_data), len(parameters)))
+        for k in range(3):
+            jacobian[rows, 3 * owners + k] = derivatives[:, k]
+
+        jacobian[:, 3 * self.peaks_count:] = self.__powers()
+        return jacobian
+
+    def normal_equations(self, parameters: np.ndarray = None) -> tuple[np.ndarray, np.ndarray]:
+        '''
+        Builds weighted curvature matrix J^T W J and gradient J^T W r from
+        windowed jacobian. Peak blocks are summed only over overlapping
+        windows, so cost grows with total window size, not channels x peaks.
+        '''
+        parameters = self.parameters if parameters is None else parameters
+        rows, owners, starts, stops, gaussians, derivatives = self.__evaluate(parameters, True)
+
+        background = self.background(parameters)
+        residuals = self.y_data - np.bincount(rows, weights=gaussians, minlength=len(self.x_data)) - background
+
+        size = len(parameters)
+        peak_size = 3 * self.peaks_count
+        curvature = np.zeros((size, size))
+        gradient = np.zeros(size)
+
+        weighted = derivatives * self.weights[rows, np.newaxis]
+        for k in range(3):
+            gradient[k: peak_size: 3] = np.bincount(owners, weights=weighted[:, k] * residuals[rows],
+                                                    minlength=self.peaks_count)
+
+        powers = self.__powers()
+        entry_powers = powers[rows]
+        for k in range(3):
+            for p in range(powers.shape[1]):
+                curvature[k: peak_size: 3, peak_size + p] = np.bincount(
+                    owners, weights=weighted[:, k] * entry_powers[:, p], minlength=self.peaks_count
+                )
+        curvature[peak_size:, :peak_size] = curvature[:peak_size, peak_size:].T
+
+        weighted_powers = powers * self.weights[:, np.newaxis]
+        curvature[peak_size:, peak_size:] = weighted_powers.T @ powers
+        gradient[peak_size:] = weighted_powers.T @ residuals
+
+        offsets = np.cumsum(stops - starts) - (stops - starts)
+        for i, j in zip(*np.nonzero(np.triu(
+            (starts[:, np.newaxis] < stops[np.newaxis, :]) & (starts[np.newaxis, :] < stops[:, np.newaxis])
+        ))):
+            low, high = max(starts[i], starts[j]), min(stops[i], stops[j])
+            first = weighted[offsets[i] + low - starts[i]: offsets[i] + high - starts[i]]
+            second = derivatives[offsets[j] + low - starts[j]: offsets[j] + high - starts[j]]
+
+            block = first.T @ second
+            curvature[3 * i: 3 * i + 3, 3 * j: 3 * j + 3] = block
+            curvature[3 * j: 3 * j + 3, 3 * i: 3 * i + 3] = block.T
+
+        return (curvature, gradient)
+
+    def chi_square(self, parameters: np.ndarray = None) -> float:
+        residuals = self.y_data - self.model(parameters)
+        return float((self.weights * residuals ** 2).sum())
+
+    def fit(self, max_iterations: int = 100, tolerance: float = 1e-8) -> FitResult:
+        damping = 1e-3
+        chi_square = self.chi_square()
+        is_converged = False
+
+        iteration = 0
+        for iteration in range(1, max_iterations + 1):
+            curvature, gradient = self.normal_equations()
+            curvature = curvature[np.ix_(self.is_free, self.is_free)]
+            gradient = gradient[self.is_free]
+
+            while True:
+                system = curvature + damping * np.diag(np.diag(curvature) + 1e-12)
+                try:
+                    step = np.linalg.solve(system, gradient)
+                except np.linalg.LinAlgError:
+                    step = np.linalg.lstsq(system, gradient, rcond=None)[0]
+
+                pretend = self.parameters.copy()
+                pretend[self.is_free] += step
+                pretend = np.clip(pretend, self.lower, self.upper)
+
+                pretend_chi_square = self.chi_square(pretend)
+                if pretend_chi_square <= chi_square:
+                    damping = max(damping / 10, 1e-12)
+                    break
+
+                damping *= 10
+                if damping > 1e12:
+                    break
+
+            if pretend_chi_square > chi_square:
+                is_converged = True
+                break
+
+            improvement = chi_square - pretend_chi_square
+            self.parameters = pretend
+            chi_square = pretend_chi_square
+
+            if improvement <= tolerance * max(chi_square, 1e-300):
+                is_converged = True
+                break
+
+        degrees_of_freedom = len(self.x_data) - int(self.is_free.sum())
+        at_bounds = self.at_bounds()
+        covariance = self.covariance(chi_square / degrees_of_freedom if degrees_of_freedom > 0 else 1.0,
+                                     self.is_free & ~at_bounds)
+        is_definite = bool(np.isfinite(np.diag(covariance)).all())
+        covariance[at_bounds, :] = np.nan
+        covariance[:, at_bounds] = np.nan
+
+        peaks = self.parameters[:3 * self.peaks_count].reshape(-1, 3)
+        return FitResult(
+            peaks[:, 0].copy(), peaks[:, 1].copy(), peaks[:, 2].copy(),
+            self.parameters[3 * self.peaks_count:].copy(),
+            chi_square, iteration, is_converged, covariance, degrees_of_freedom, at_bounds, is_definite
+        )
+
+    def at_bounds(self) -> np.ndarray:
+        '''
+        Free parameters which stand on their lower or upper bound.
+        '''
+        return self.is_free & ((self.parameters <= self.lower) | (self.parameters >= self.upper))
+
+    def covariance(self, scale: float = 1.0, is_free: np.ndarray = None) -> np.ndarray:
+        '''
+        Parameters covariance at current parameters: inverse of J^T W J
+        over free parameters, multiplied by scale (reduced chi square in fit).
+        is_free overrides free parameters, e.g. to treat bounded as fixed.
+        Free part is NaN if curvature is not positive definite.
+        Costs one more evaluation of windowed normal equations.
+        '''
+        curvature, _ = self.normal_equations()
+        is_free = self.is_free if is_free is None else is_free
+        free = np.ix_(is_free, is_free)
+
+        covariance = np.zeros((len(self.parameters), len(self.parameters)))
+        try:
+            lower = np.linalg.cholesky(curvature[free])
+        except np.linalg.LinAlgError:
+            covariance[free] = np.nan
+            return covariance
+
+        inverse = np.linalg.inv(lower)
+        covariance[free] = (inverse.T @ inverse) * scale
+        return covariance
+
+
+if __name__ == '__main__':
+    pass
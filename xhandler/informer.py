@@ -1,8 +1,72 @@
-from ensdf import NAME2CHARGE, CHARGE2NAME
+import threading
+from collections import OrderedDict
+from typing import Any, Callable
+
+from ensdf import NAME2CHARGE, CHARGE2NAME, DATABASE
 from ensdf import mass_excess_of, excitation_energies, spin_parity, gammas
 
 
+class LRUCache:
+    '''
+    Bounded least recently used cache with hit/miss counters.
+    '''
+    def __init__(self, maxsize: int = 256) -> None:
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+
+        self.__data: OrderedDict[tuple, Any] = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.__data)
+
+    def get(self, key: tuple, resolver: Callable[[], Any]) -> Any:
+        with self.__lock:
+            if key in self.__data:
+                self.hits += 1
+                self.__data.move_to_end(key)
+                return self.__data[key]
+
+            self.misses += 1
+
+        value = resolver()
+
+        with self.__lock:
+            self.__data[key] = value
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+        return value
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self) -> dict[str, int]:
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self.__data), 'maxsize': self.maxsize}
+
+
 class Informator:
+    cache = LRUCache(maxsize=512)
+    generation = 0
+
+    @staticmethod
+    def invalidate() -> None:
+        '''
+        Drops all memoized lookups and reloads ENSDF database on next request.
+        Must be called when ENSDF files was changed.
+        '''
+        Informator.cache.clear()
+        DATABASE.clear()
+        Informator.generation += 1
+
+    @staticmethod
+    def cache_info() -> dict[str, int]:
+        return Informator.cache.info()
 
     @staticmethod
     def is_exist(z: int, a: int) -> bool:
@@ -14,7 +78,7 @@ class Informator:
             return False
 
         try:
-            delta_m = mass_excess_of(z, a)
+            delta_m = Informator.mass_excess(z, a)
             return True
         except:
             return False
@@ -45,19 +109,19 @@ class Informator:
 
     @staticmethod
     def mass_excess(z: int, a: int) -> float:
-        return mass_excess_of(z, a)
+        return Informator.cache.get(('mass_excess', z, a), lambda: mass_excess_of(z, a))
 
     @staticmethod
     def states(z: int, a: int) -> list[float]:
-        return excitation_energies(z, a)
+        return Informator.cache.get(('states', z, a), lambda: excitation_energies(z, a))
     
     @staticmethod
     def spins(z: int, a: int) -> list[tuple[float, bool]]:
-        return spin_parity(z, a)
+        return Informator.cache.get(('spins', z, a), lambda: spin_parity(z, a))
 
     @staticmethod
     def wigner_widths(z: int, a: int) -> list[float]:
-        return gammas(z, a)
+        return Informator.cache.get(('wigner_widths', z, a), lambda: gammas(z, a))
 
 
 if __name__ == '__main__':
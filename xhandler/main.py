@@ -1,106 +1,219 @@
-import os, sys
-import threading
+import queue, threading
+from typing import Callable
 
 from analysis import Analytics, PeakSupervisor
-from workbook import WorkbookMaster, WorkbookParser
+from workbook import WorkbookMaster
 from shunting_yard import ReactionMaster, Reaction
+from spectra import Sleuth
+from cache import AnalyticsCache
+from decimation import DecimationPyramid
+from session import Session
 
 import numpy as np
 import matplotlib.pyplot as pyplot
-from matplotlib.backend_bases import MouseEvent
+from matplotlib.axes import Axes
+from matplotlib.artist import Artist
+from matplotlib.collections import LineCollection
+from matplotlib.backend_bases import MouseEvent, DrawEvent
 
 
-SELECTED_DOTS_X = []
-SELECTED_DOTS_Y = []
-CACHED_SPECTRES: list[Analytics] = []
-
-
-class Sleuth:
-    def __init__(self, directory: str) -> None:
-        self.dir = directory
-        self.angles = self.get_angles_list()
-
-    def get_angles_list(self) -> list[float]:
-        files = self.only_files(os.listdir(self.dir))
-        return [self.angle_from_name(file) for file in files]
-
-    def angle_from_name(self, file: str) -> float:
-        return float(file.split('.')[0])
-    
-    def only_files(self, dirs: list[str]) -> list[str]:
-        return [direc for direc in dirs if '.' in direc]
-    
-    def to_spectrum(self, angle: float) -> np.ndarray:
-        return np.loadtxt(f'{self.dir}\\{int(angle)}.txt')
+CACHED_SPECTRES = AnalyticsCache()
+REQUESTS_INTERVAL = 50
+FAILURES = (RuntimeError, KeyError, ValueError, np.linalg.LinAlgError)
 
 
 class Observer:
+    '''
+    Rendering layer over one axes. Spectrum, fitted peaks and theory dots
+    are persistent artists, commands only replace their data. Nothing is
+    drawn until refresh(), which is called once per command: full draw when
+    spectrum changed, otherwise overlays are blitted over cached background.
+    Spectrum line shows min/max decimation of visible range, it is
+    re-decimated whenever x limits change (zoom, pan, autoscale).\n
+    Matplotlib is touched only on GUI thread. Other threads post drawing
+    requests, which GUI timer executes in order, and read picked points
+    from thread-safe picks queue.
+    '''
     def __init__(self) -> None:
         self.figure, self.axes = pyplot.subplots()
-        self.figure.canvas.mpl_connect('button_press_event', self.select_point)
+        self.canvas = self.figure.canvas
+        self.canvas.mpl_connect('button_press_event', self.select_point)
+        self.canvas.mpl_connect('draw_event', self.__on_draw)
+
+        is_animated = self.canvas.supports_blit
+        self.spectrum_line, = self.axes.plot([], [])
+        self.peaks_collection = LineCollection([], colors='red', animated=is_animated)
+        self.axes.add_collection(self.peaks_collection)
+        self.dots_line, = self.axes.plot([], [], 'o', color='red', label='Theoretical peaks center.',
+                                         animated=is_animated)
+
+        self.pyramid = DecimationPyramid([], [])
+        self.background = None
+        self.__is_stale = False
+        self.__is_overlay_stale = False
+
+        self.picks: queue.Queue[tuple[float, float]] = queue.Queue()
+        self.requests: queue.Queue[tuple[Callable, tuple]] = queue.Queue()
+
+        self.axes.callbacks.connect('xlim_changed', self.__on_xlim_changed)
+        self.timer = self.canvas.new_timer(interval=REQUESTS_INTERVAL)
+        self.timer.add_callback(self.process_requests)
+        self.timer.start()
+
+    @property
+    def overlays(self) -> list[Artist]:
+        return [self.peaks_collection, self.dots_line]
 
     def select_point(self, event: MouseEvent) -> str | None:
-        if event.dblclick:
-            SELECTED_DOTS_X.append(event.xdata)
-            SELECTED_DOTS_Y.append(event.ydata)
+        if event.dblclick and event.inaxes is self.axes:
+            self.picks.put((event.xdata, event.ydata))
 
             print(f'Point (x: {round(event.xdata, 2)}, y: {round(event.ydata, 2)}) was selected.')
-        
+
+    def take_picks(self) -> list[tuple[float, float]]:
+        '''
+        Points picked since last call. Safe to call from any thread.
+        '''
+        taken = []
+        while True:
+            try:
+                taken.append(self.picks.get_nowait())
+            except queue.Empty:
+                return taken
+
+    def post(self, request: Callable, *args) -> None:
+        '''
+        Queues call to be run on GUI thread. Safe to call from any thread.
+        '''
+        self.requests.put((request, args))
+
+    def process_requests(self) -> None:
+        '''
+        Runs queued requests on GUI thread (called by timer).
+        '''
+        while True:
+            try:
+                request, args = self.requests.get_nowait()
+            except queue.Empty:
+                return
+            request(*args)
+
+    def __on_draw(self, event: DrawEvent) -> None:
+        if not self.canvas.supports_blit:
+            return
+
+        self.background = self.canvas.copy_from_bbox(self.axes.bbox)
+        self.__draw_overlays()
+
+    def __on_xlim_changed(self, axes: Axes) -> None:
+        low, high = axes.get_xlim()
+        self.spectrum_line.set_data(*self.pyramid.query(min(low, high), max(low, high), self.__buckets()))
+
+    def __buckets(self) -> int:
+        return max(int(self.axes.bbox.width), 1)
+
+    def __draw_overlays(self) -> None:
+        for artist in self.overlays:
+            self.axes.draw_artist(artist)
+
+    def refresh(self) -> None:
+        if self.__is_stale or self.background is None or not self.canvas.supports_blit:
+            self.canvas.draw_idle()
+        elif self.__is_overlay_stale:
+            self.canvas.restore_region(self.background)
+            self.__draw_overlays()
+            self.canvas.blit(self.axes.bbox)
+
+        self.__is_stale = False
+        self.__is_overlay_stale = False
+
     def clear_all_stuff(self) -> None:
         self.clear_selected_dots()
-        self.axes.clear()
-        self.figure.canvas.draw()
+        self.pyramid = DecimationPyramid([], [])
+        self.spectrum_line.set_data([], [])
+        self.clear_overlays()
+        self.__is_stale = True
 
     def clear_selected_dots(self) -> None:
-        SELECTED_DOTS_X.clear()
-        SELECTED_DOTS_Y.clear()
+        self.take_picks()
 
-    def draw_uncalibrated_spectrum(self, spectrum: np.ndarray) -> None:
-        self.axes.clear()
+    def clear_overlays(self) -> None:
+        self.peaks_collection.set_segments([])
+        self.dots_line.set_data([], [])
+        self.__is_overlay_stale = True
 
-        self.axes.plot(np.arange(1, len(spectrum) + 1), spectrum)
-        self.figure.canvas.draw() 
+    def draw_uncalibrated_spectrum(self, spectrum: np.ndarray) -> None:
+        self.__show_spectrum(np.arange(1, len(spectrum) + 1), spectrum)
 
     def draw_calibrated_spectrum(self, spectrum: np.ndarray, energy_view: np.ndarray) -> None:
-        self.axes.clear()
+        self.__show_spectrum(energy_view, spectrum)
 
-        self.axes.plot(energy_view, spectrum)
-        self.figure.canvas.draw()
+    def __show_spectrum(self, xs: np.ndarray, ys: np.ndarray) -> None:
+        self.pyramid = DecimationPyramid(xs, ys)
+        self.spectrum_line.set_data(*self.pyramid.full(self.__buckets()))
+        self.clear_overlays()
+
+        self.axes.relim()
+        self.axes.autoscale_view()
+        self.__is_stale = True
 
     def draw_peak(self, peak: PeakSupervisor) -> None:
-        curve = peak.lorentzian
+        self.draw_peaks([peak])
 
-        self.axes.plot(curve.three_sigma(), curve.function(), color='red')
-        self.figure.canvas.draw()
+    def draw_peaks(self, peaks: list[PeakSupervisor]) -> None:
+        segments = [
+            np.column_stack((peak.lorentzian.three_sigma(), peak.lorentzian.function()))
+            for peak in peaks
+        ]
+        self.peaks_collection.set_segments(list(self.peaks_collection.get_segments()) + segments)
+        self.__is_overlay_stale = True
 
     def scat_dots(self, xs: np.ndarray, ys: np.ndarray) -> None:
-        self.axes.scatter(xs, ys, color='red', label='Theoretical peaks center.')
-        self.figure.canvas.draw()
+        self.dots_line.set_data(xs, ys)
+        self.__is_overlay_stale = True
 
 #TODO: Implement all class.
 class Commandor:
+    '''
+    Interactive prompt over Session, runs on its own thread. Session runs
+    analysis on its worker and posts drawing to Observer, so GUI stays
+    responsive while peaks are fitted. Commandor only waits for results.
+    '''
     def __init__(self, path_to_find: str) -> None:
+        self.path = path_to_find
         self.sleuth = Sleuth(path_to_find)
         self.observer = Observer()
         self.workbooker = WorkbookMaster(path_to_find)
+        self.selected: list[tuple[float, float]] = []
 
-        self.analitics: Analytics = None
+        self.session: Session = None
         self.reaction: Reaction = None
 
-        self.is_spectrum_opened = False
+    @property
+    def analitics(self) -> Analytics:
+        return self.session.analytics
+
+    @property
+    def is_spectrum_opened(self) -> bool:
+        return self.session is not None and self.session.is_opened
 
     def main(self) -> None:
         self.reaction = self.take_reaction()
+        self.session = Session(self.path, self.reaction, self.observer, CACHED_SPECTRES, self.workbooker)
         while True:
             print(self.show_possible_commands())
 
             comm = input('What do we do? Type here: ')
             msg = self.handle_command(comm)
+            self.observer.post(self.observer.refresh)
             if msg == 'quit':
                 break
 
             print(msg)
 
+        self.session.shutdown()
+        self.observer.post(pyplot.close, self.observer.figure)
+
     def show_possible_commands(self) -> list[str]:
         if not self.is_spectrum_opened:
             return ['open', 'change', 'read', 'write down', 'quit']
@@ -124,9 +237,12 @@ class Commandor:
         print('We need info about your nuclear reaction.')
 
         str_react = input('Please write down analyzing nuclear reaction: ')
-        energy = float(input('Type here beam energy (in MeV): '))
+        master = ReactionMaster(str_react)
+        if master.energy is None:
+            master.energy = float(input('Type here beam energy (in MeV): '))
 
-        return ReactionMaster(str_react, energy).to_reaction()
+        answer = input('Use relativistic kinematics? Yes or No: ')
+        return master.to_reaction(answer.lower() == 'yes')
 
     def open(self) -> str:
         print('Finded angles:')
@@ -141,39 +257,29 @@ class Commandor:
             print('Please, write correctly!')
             return self.open()
         
-        self.__open_spectrum(comm)
+        try:
+            self.__open_spectrum(comm)
+        except FAILURES as error:
+            return f'Opening failed: {error}\n'
+
         return f'Spectrum of {self.analitics.angle} was opened.\n'
     
     def __open_spectrum(self, pretend: str) -> None:
-        pretend = float(pretend)
-        if pretend in CACHED_SPECTRES:
-            self.__open_cached_spectrum(pretend)
-            return
-
-        spectrum = self.sleuth.to_spectrum(pretend)
-
-        self.observer.draw_uncalibrated_spectrum(spectrum)
-
-        self.analitics = Analytics(spectrum, self.reaction, pretend)
-        self.is_spectrum_opened = True
-
-    def __open_cached_spectrum(self, angle: float) -> None:
-        prepared = next(i for i in CACHED_SPECTRES if i.angle == angle)
-        if not prepared.is_calibrated:
-            self.observer.draw_uncalibrated_spectrum(prepared.spectrum)
-
-        self.observer.draw_calibrated_spectrum(prepared.spectrum, prepared.energy_view())
-        for p in prepared.peaks:
-            self.observer.draw_peak(p)
+        self.selected.clear()
+        self.observer.take_picks()
+        self.session.open(float(pretend)).result()
 
     def close(self) -> str:
         print("If you quit immediately, your changes doesn't applies.")
         answer = input('Are you serious? Yes or No: ')
 
         if answer.lower() == 'yes':
-            self.observer.clear_all_stuff()
-            self.analitics = None
-            self.is_spectrum_opened = False
+            try:
+                self.session.close().result()
+            except FAILURES as error:
+                return f'Closing failed: {error}\n'
+
+            self.selected.clear()
 
             return f'The spectrum was closed with no save.\n'
         else:
@@ -184,15 +290,18 @@ class Commandor:
 
         answer = input('Type here: ')
 
-        if answer.isdigit() and float(answer) in [i.angle for i in CACHED_SPECTRES]:
-            analyzed = next(i for i in CACHED_SPECTRES if i.angle == float(answer))
-            self.workbooker.write(str(analyzed) + '\n\n')
+        if answer.isdigit() and float(answer) in CACHED_SPECTRES:
+            try:
+                self.session.write(float(answer)).result()
+            except FAILURES as error:
+                return f'Writing failed: {error}\n'
+
             return 'Analyzed parameters was wroted to workbook.\n'
         else:
             return 'Cannot find this angle inside the analyzed ones.\n'
 
     def __show_analyzed_spectres(self) -> None:
-        cached = [i.angle for i in CACHED_SPECTRES]
+        cached = CACHED_SPECTRES.angles
 
         print('Choose the angle in analyzed spectrums angles:')
         print(cached)
@@ -209,14 +318,26 @@ class Commandor:
 
         print('You can double click to graph, to pick points on them.')
         print('The last picked 2 points will be used for calibration.')
-        input('Please, press enter to continue, when you finish selecting of points.\n')
+        answer = input('Please, press enter to continue, when you finish selecting of points, or type auto.\n')
 
-        val, e0 = self.analitics.calibrate((int(SELECTED_DOTS_X[-1]), int(SELECTED_DOTS_X[-2])))
+        if answer.strip().lower() == 'auto':
+            try:
+                result = self.session.calibrate('auto').result()
+            except FAILURES as error:
+                return f'Automatic calibration failed: {error}\n'
 
-        self.observer.draw_calibrated_spectrum(self.analitics.spectrum, self.analitics.energy_view())
+            val, e0 = result.scale_value, result.scale_shift
+            print(f'{len(result)} peaks were matched, rms of residuals: {round(result.rms, 4)} MeV')
+        else:
+            self.selected += self.observer.take_picks()
+            if len(self.selected) < 2:
+                return 'Pick at least 2 points on graph for calibration.\n'
 
-        peaks_indexes = self.analitics.try_find_peaks()
-        self.observer.scat_dots(self.analitics.theory_peaks[:len(peaks_indexes)], self.analitics.spectrum[peaks_indexes])
+            channels = (int(self.selected[-1][0]), int(self.selected[-2][0]))
+            try:
+                val, e0 = self.session.calibrate(channels).result()
+            except FAILURES as error:
+                return f'Calibration failed: {error}\n'
 
         return f'calibrated by: E(ch) = {round(val, 3)}ch + {round(e0, 3)}\n'
 
@@ -227,19 +348,20 @@ class Commandor:
         if not self.analitics.is_calibrated:
             return 'Spectrum must be calibrated first.\n'
         
-        peaks = self.analitics.create_peaks()
-        for peak in peaks:
-            self.observer.draw_peak(peak)
+        try:
+            self.session.fit().result()
+        except FAILURES as error:
+            return f'Fitting failed: {error}\n'
 
         return 'All peaks was drown.\n'
 
     def save(self) -> str:
-        CACHED_SPECTRES.append(self.analitics)
-
-        self.analitics = None
-        self.is_spectrum_opened = False
+        try:
+            angle = self.session.save().result()
+        except FAILURES as error:
+            return f'Saving failed: {error}\n'
 
-        return f'Spectrum of {CACHED_SPECTRES[-1].angle} degree was saved.\n' + \
+        return f'Spectrum of {angle} degree was saved.\n' + \
                 'To write this to workbook type *write down*\n'
 
     def error_message(self) -> str:
@@ -253,7 +375,7 @@ def startup() -> None:
     path = input('Please write the PATH to spectres: ')
     main_commandor = Commandor(path)
 
-    loop = threading.Thread(target=main_commandor.main)
+    loop = threading.Thread(target=main_commandor.main, daemon=True)
     loop.start()
     pyplot.show()
 
@@ -0,0 +1,109 @@
+import numpy as np
+from fitting import FWHM_TO_SIGMA
+
+
+def snip_background(spectrum: np.ndarray, iterations: int) -> np.ndarray:
+    '''
+    SNIP background estimation. Clipping is done on LLS transformed
+    data with window growing from 1 to `iterations` channels.
+    '''
+    spectrum = np.maximum(np.asarray(spectrum, dtype=np.float64), 0)
+    transformed = np.log(np.log(np.sqrt(spectrum + 1) + 1) + 1)
+
+    iterations = min(iterations, (len(spectrum) - 1) // 2)
+    for p in range(1, iterations + 1):
+        means = (transformed[:-2 * p] + transformed[2 * p:]) / 2
+        transformed[p: -p] = np.minimum(transformed[p: -p], means)
+
+    return (np.exp(np.exp(transformed) - 1) - 1) ** 2 - 1
+
+
+def second_derivative_kernel(fwhm: float) -> np.ndarray:
+    '''
+    Negative second derivative of gaussian with given fwhm (in channels),
+    cut at 3 sigma and balanced to zero sum so linear background vanishes.
+    '''
+    sigma = max(fwhm * FWHM_TO_SIGMA, 0.5)
+    half = max(int(np.ceil(3 * sigma)), 2)
+    xs = np.arange(-half, half + 1)
+
+    kernel = (1 - xs ** 2 / sigma ** 2) * np.exp(-xs ** 2 / (2 * sigma ** 2))
+    return kernel - kernel.mean()
+
+
+class PeakSearch:
+    '''
+    Automatic peak finder: SNIP background, smoothed second derivative
+    and significance threshold, all in array operations.
+    '''
+    def __init__(self, spectrum: np.ndarray, fwhm: float, threshold: float = 3.0,
+                 min_height: float = 0, iterations: int = None) -> None:
+        self.spectrum = np.asarray(spectrum, dtype=np.float64)
+        self.fwhm = fwhm
+        self.threshold = threshold
+        self.min_height = min_height
+
+        self.iterations = iterations if iterations is not None else max(int(2 * fwhm), 4)
+
+        self.background = snip_background(self.spectrum, self.iterations)
+        self.net = self.spectrum - self.background
+
+        kernel = second_derivative_kernel(fwhm)
+        self.margin = len(kernel) // 2
+        self.response = np.convolve(self.net, kernel, mode='same')
+        variance = np.convolve(np.maximum(self.spectrum, 1), kernel ** 2, mode='same')
+        self.significance = self.response / np.sqrt(variance)
+
+    def peaks(self) -> np.ndarray:
+        '''
+        Channel indexes of significant local maxima of response, ascending.
+        '''
+        response = self.response
+        is_maximum = np.zeros(len(response), dtype=np.bool_)
+        is_maximum[1:-1] = (response[1:-1] > response[:-2]) & (response[1:-1] >= response[2:])
+
+        is_maximum &= self.significance > self.threshold
+        is_maximum &= self.net > self.min_height
+
+        is_maximum[:self.margin] = False
+        is_maximum[len(is_maximum) - self.margin:] = False
+
+        return np.flatnonzero(is_maximum)
+
+
+def find_peaks(spectrum: np.ndarray, fwhm: float, threshold: float = 3.0) -> np.ndarray:
+    return PeakSearch(spectrum, fwhm, threshold).peaks()
+
+
+def match_to_theory(found: np.ndarray, theory: np.ndarray, tolerance: float) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Matches found peak energies to theory energies by sorted search.
+    Every theory level takes at most one peak, the closest one within
+    tolerance. Non-finite theory energies (closed levels) are skipped.
+    Returns indexes of matched found peaks and theory levels, ordered
+    by theory index.
+    '''
+    found = np.asarray(found, dtype=np.float64)
+    theory = np.asarray(theory, dtype=np.float64)
+    valid = np.flatnonzero(np.isfinite(theory))
+    if len(found) == 0 or len(valid) == 0:
+        return (np.array([], dtype=np.int64), np.array([], dtype=np.int64))
+
+    order = valid[np.argsort(theory[valid])]
+    ordered = theory[order]
+
+    positions = np.searchsorted(ordered, found)
+    left = np.clip(positions - 1, 0, len(ordered) - 1)
+    right = np.clip(positions, 0, len(ordered) - 1)
+    nearest = np.where(np.abs(found - ordered[left]) <= np.abs(found - ordered[right]), left, right)
+
+    distances = np.abs(found - ordered[nearest])
+    candidates = np.flatnonzero(distances <= tolerance)
+    candidates = candidates[np.argsort(distances[candidates], kind='stable')]
+
+    levels, first = np.unique(order[nearest[candidates]], return_index=True)
+    return (candidates[first], levels)
+
+
+if __name__ == '__main__':
+    pass
@@ -1,40 +1,112 @@
+from __future__ import annotations
+import threading
 import numpy as np
 from informer import Informator
 
 
+ATOMIC_MASS_UNIT = 931.494
+
+
 class Nuclei:
-    def __init__(self, charge: int, nuclons: int) -> None:
-        self.nuclons = nuclons
-        self.charge = charge
+    '''
+    Nuclei are interned: Nuclei(charge, nuclons) gives one shared object
+    per (charge, nuclons), so its ENSDF data is resolved once per process.
+    '''
+    __interned: dict[tuple[int, int], Nuclei] = {}
+    __lock = threading.Lock()
+
+    def __new__(cls, charge: int, nuclons: int) -> Nuclei:
+        key = (int(charge), int(nuclons))
+        with Nuclei.__lock:
+            if key not in Nuclei.__interned:
+                instance = super().__new__(cls)
+                instance.charge, instance.nuclons = key
+
+                instance.__resolved = {}
+                instance.__generation = Informator.generation
+                Nuclei.__interned[key] = instance
+
+            return Nuclei.__interned[key]
+
+    def __reduce__(self) -> tuple:
+        return (Nuclei, (self.charge, self.nuclons))
 
     def __str__(self) -> str:
         return Informator.name(self.charge, self.nuclons)
 
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Nuclei):
+            return NotImplemented
+        return self.charge == other.charge and self.nuclons == other.nuclons
+
+    def __hash__(self) -> int:
+        return hash((self.charge, self.nuclons))
+
+    def __resolve(self, field: str) -> object:
+        if self.__generation != Informator.generation:
+            self.__resolved = {}
+            self.__generation = Informator.generation
+
+        if field not in self.__resolved:
+            self.__resolved[field] = getattr(Informator, field)(self.charge, self.nuclons)
+
+        return self.__resolved[field]
+
     @property
     def mass_excess(self) -> float:
-        return Informator.mass_excess(self.charge, self.nuclons)
+        return self.__resolve('mass_excess')
     
     @property
     def states(self) -> list[float]:
-        return Informator.states(self.charge, self.nuclons)
+        return self.__resolve('states')
     
     @property
     def wigner_widths(self) -> list[float]:
-        return Informator.wigner_widths(self.charge, self.nuclons)
+        return self.__resolve('wigner_widths')
     
     @property
     def mass(self) -> float:
         return self.charge * 938.27 + (self.nuclons - self.charge) * 939.57
 
+    @property
+    def atomic_mass(self) -> float:
+        return self.nuclons * ATOMIC_MASS_UNIT + self.mass_excess
+
+
+class Kinematics:
+    '''
+    Result of batched reaction kinematics. Energies are in MeV,
+    angles in degrees. Kinematically forbidden cells are NaN.
+    '''
+    def __init__(self, states: np.ndarray, angles: np.ndarray, fragment_energy: np.ndarray,
+                 residual_energy: np.ndarray, residual_angle: np.ndarray) -> None:
+        self.states = states
+        self.angles = angles
+
+        self.fragment_energy = fragment_energy
+        self.residual_energy = residual_energy
+        self.residual_angle = residual_angle
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.fragment_energy.shape
+
 
 class Reaction:
-    def __init__(self, beam: Nuclei, target: Nuclei, fragment: Nuclei, beam_energy: float) -> None:
+    def __init__(self, beam: Nuclei, target: Nuclei, fragment: Nuclei, beam_energy: float,
+                 relativistic: bool = False) -> None:
+        '''
+        With relativistic flag kinematics are solved exactly from
+        four-momentum conservation with masses built from mass excesses.
+        Otherwise classic non-relativistic r/s factors are used.
+        '''
         self.beam = beam
         self.target = target
         self.fragment = fragment
         self.residual = self.__residual_nuclei()
 
         self.beam_energy = beam_energy
+        self.relativistic = relativistic
 
     @property
     def is_elastic(self) -> bool:
@@ -50,50 +122,87 @@ class Reaction:
         return q0 - residual_state
     
     def fragment_energy(self, residual_state: float, fragment_angle: float) -> np.ndarray:
-        r = Reaction.__r_factor(
-            self.beam.mass, 
-            self.beam_energy, 
-            self.fragment.mass, 
-            self.residual.mass, 
-            fragment_angle * np.pi / 180
-        )
+        return self.kinematics(residual_state, fragment_angle).fragment_energy[0, 0]
+    
+    def residual_energy(self, residual_state: float, fragment_angle: float) -> np.ndarray:
+        return self.kinematics(residual_state, fragment_angle).residual_energy[0, 0]
+    
+    def residual_angle(self, residual_state: float, fragment_angle: float) -> float:
+        return np.radians(self.kinematics(residual_state, fragment_angle).residual_angle[0, 0])
 
-        s = Reaction.__s_factor(
-            self.beam.mass, 
-            self.beam_energy, 
-            self.fragment.mass, 
-            self.residual.mass, 
-            self.reaction_quit(residual_state)
-        )
+    def kinematics(self, residual_states: np.ndarray, fragment_angles: np.ndarray) -> Kinematics:
+        '''
+        Batched two-body kinematics. Residual states (MeV) are broadcasted
+        along rows and fragment lab angles (degrees) along columns, so
+        every result is a (states x angles) matrix.
+        '''
+        states = np.atleast_1d(np.asarray(residual_states, dtype=np.float64))[:, np.newaxis]
+        angles = np.atleast_1d(np.asarray(fragment_angles, dtype=np.float64))[np.newaxis, :]
+
+        if self.relativistic:
+            return self.__relativistic_kinematics(states, angles)
+        return self.__classic_kinematics(states, angles)
+
+    def __classic_kinematics(self, states: np.ndarray, angles: np.ndarray) -> Kinematics:
+        quits = self.reaction_quit(states)
 
-        return (r + np.sqrt(r ** 2 + s)) ** 2
-    
-    def residual_energy(self, residual_state: float) -> np.ndarray:
         r = Reaction.__r_factor(
             self.beam.mass,
-            self.beam_energy, 
-            self.residual.mass,
+            self.beam_energy,
             self.fragment.mass,
-            self.residual_angle(residual_state)
+            self.residual.mass,
+            np.radians(angles)
         )
 
         s = Reaction.__s_factor(
             self.beam.mass,
             self.beam_energy,
-            self.residual.mass,
             self.fragment.mass,
-            self.reaction_quit(residual_state)
+            self.residual.mass,
+            quits
         )
 
-        return (r + np.sqrt(r ** 2 + s)) ** 2
-    
-    def residual_angle(self, residual_state: float, fragment_angle: float) -> float:
-        fragment_ears = self.fragment_energy(residual_state)
-        energy_relation = np.sqrt(self.beam.mass() * self.beam_energy / (self.fragment.mass() * fragment_ears))
+        with np.errstate(invalid='ignore'):
+            fragment_energy = (r + np.sqrt(r ** 2 + s)) ** 2
 
-        return np.pi / 2 - np.arctan(
-            (energy_relation - np.cos(fragment_angle * np.pi / 180)) / np.sin(fragment_angle * np.pi / 180)
-        )
+        residual_energy = self.beam_energy + quits - fragment_energy
+
+        beam_momentum = np.sqrt(2 * self.beam.mass * self.beam_energy)
+        fragment_momentum = np.sqrt(2 * self.fragment.mass * fragment_energy)
+        residual_angle = np.degrees(np.arctan2(
+            fragment_momentum * np.sin(np.radians(angles)),
+            beam_momentum - fragment_momentum * np.cos(np.radians(angles))
+        ))
+
+        return Kinematics(states[:, 0], angles[0], fragment_energy, residual_energy, residual_angle)
+
+    def __relativistic_kinematics(self, states: np.ndarray, angles: np.ndarray) -> Kinematics:
+        beam_mass = self.beam.atomic_mass
+        target_mass = self.target.atomic_mass
+        fragment_mass = self.fragment.atomic_mass
+        residual_mass = self.residual.atomic_mass + states
+
+        beam_momentum = np.sqrt(self.beam_energy ** 2 + 2 * self.beam_energy * beam_mass)
+        total_energy = self.beam_energy + beam_mass + target_mass
+        invariant = total_energy ** 2 - beam_momentum ** 2
+
+        cosine = np.cos(np.radians(angles))
+        half_sum = (invariant + fragment_mass ** 2 - residual_mass ** 2) / 2
+        denominator = total_energy ** 2 - (beam_momentum * cosine) ** 2
+
+        with np.errstate(invalid='ignore'):
+            discriminant = np.sqrt(half_sum ** 2 - fragment_mass ** 2 * denominator)
+            fragment_momentum = (half_sum * beam_momentum * cosine + total_energy * discriminant) / denominator
+
+        fragment_energy = np.sqrt(fragment_momentum ** 2 + fragment_mass ** 2) - fragment_mass
+        residual_energy = total_energy - (fragment_energy + fragment_mass) - residual_mass
+
+        residual_angle = np.degrees(np.arctan2(
+            fragment_momentum * np.sin(np.radians(angles)),
+            beam_momentum - fragment_momentum * cosine
+        ))
+
+        return Kinematics(states[:, 0], angles[0], fragment_energy, residual_energy, residual_angle)
     
     @staticmethod
     def __r_factor(beam_mass: float, beam_energy: float, 
@@ -0,0 +1,161 @@
+import numpy as np
+
+
+ZERO_RUN = 50
+ZERO_BACKOFF = 20
+
+
+def stack(spectres: list[np.ndarray]) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Stacks spectres of different length into zero padded
+    (angles x channels) matrix. Returns matrix and true lengths.
+    '''
+    lengths = np.array([len(spectrum) for spectrum in spectres], dtype=np.int64)
+    stacked = np.zeros((len(spectres), lengths.max(initial=0)))
+    for i, spectrum in enumerate(spectres):
+        stacked[i, :lengths[i]] = spectrum
+
+    return (stacked, lengths)
+
+
+def zero_run_cutoff(spectra: np.ndarray, lengths: np.ndarray = None,
+                    run: int = ZERO_RUN, backoff: int = ZERO_BACKOFF) -> np.ndarray | int:
+    '''
+    Finds where spectrum ends: first run of `run` zero channels followed
+    by at least one more channel. Cutoff is placed `backoff` channels
+    before the end of that run. Works on one spectrum or on stacked
+    (angles x channels) matrix; spectrum without such run keeps its length.
+    '''
+    spectra = np.asarray(spectra)
+    is_single = spectra.ndim == 1
+    matrix = np.atleast_2d(spectra)
+    lengths = np.full(len(matrix), matrix.shape[1]) if lengths is None else np.asarray(lengths)
+
+    if matrix.shape[1] <= run:
+        return int(lengths[0]) if is_single else lengths.copy()
+
+    zeros = np.zeros((len(matrix), matrix.shape[1] + 1), dtype=np.int64)
+    np.cumsum(matrix == 0, axis=1, out=zeros[:, 1:])
+    is_empty_window = (zeros[:, run:] - zeros[:, :-run]) == run
+
+    starts = np.arange(is_empty_window.shape[1])
+    is_empty_window &= starts[np.newaxis, :] + run < lengths[:, np.newaxis]
+
+    is_found = is_empty_window.any(axis=1)
+    cutoffs = np.where(is_found, is_empty_window.argmax(axis=1) + run - backoff, lengths)
+
+    return int(cutoffs[0]) if is_single else cutoffs
+
+
+def rebin(spectra: np.ndarray, factor: int) -> np.ndarray:
+    '''
+    Sums every `factor` neighbour channels, remainder is dropped.
+    '''
+    if factor <= 1:
+        return spectra
+
+    spectra = np.asarray(spectra)
+    usable = spectra.shape[-1] // factor * factor
+    return spectra[..., :usable].reshape(*spectra.shape[:-1], -1, factor).sum(axis=-1)
+
+
+def smooth(spectra: np.ndarray, width: int, valid: np.ndarray = None) -> np.ndarray:
+    '''
+    Moving average over odd `width` channels along last axis.
+    Edges are averaged over available channels only. Valid is mask of
+    real channels (e.g. not padding of stacked spectres), only they are
+    averaged, so padded and unpadded spectrum give the same result.
+    '''
+    if width <= 1:
+        return spectra
+
+    spectra = np.asarray(spectra, dtype=np.float64)
+    half = width // 2
+    channels = np.arange(spectra.shape[-1])
+    lower = np.clip(channels - half, 0, spectra.shape[-1])
+    upper = np.clip(channels + half + 1, 0, spectra.shape[-1])
+
+    sums = np.zeros((*spectra.shape[:-1], spectra.shape[-1] + 1))
+    if valid is None:
+        np.cumsum(spectra, axis=-1, out=sums[..., 1:])
+        return (sums[..., upper] - sums[..., lower]) / (upper - lower)
+
+    counts = np.zeros(sums.shape)
+    np.cumsum(np.where(valid, spectra, 0), axis=-1, out=sums[..., 1:])
+    np.cumsum(valid, axis=-1, out=counts[..., 1:])
+
+    counts = counts[..., upper] - counts[..., lower]
+    return np.where(valid, (sums[..., upper] - sums[..., lower]) / np.maximum(counts, 1), 0)
+
+
+def dead_channels(spectra: np.ndarray, threshold: float) -> np.ndarray:
+    '''
+    Mask of zero channels surrounded by two channels above threshold.
+    '''
+    spectra = np.asarray(spectra)
+    mask = np.zeros(spectra.shape, dtype=np.bool_)
+    mask[..., 1:-1] = (spectra[..., 1:-1] == 0) & (spectra[..., :-2] > threshold) & (spectra[..., 2:] > threshold)
+    return mask
+
+
+def mask_channels(spectra: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    '''
+    Replaces masked channels by mean of their neighbours.
+    '''
+    if not mask.any():
+        return spectra
+
+    spectra = np.array(spectra, dtype=np.float64)
+    left = np.roll(spectra, 1, axis=-1)
+    right = np.roll(spectra, -1, axis=-1)
+    spectra[mask] = (left[mask] + right[mask]) / 2
+    return spectra
+
+
+class Preprocessor:
+    '''
+    Spectrum preprocessing stage:
+    dead channels masking -> trailing zeros truncation -> smoothing -> rebinning.\n
+    Every step works on whole arrays, so one spectrum and stacked
+    batch of angles cost the same number of interpreter calls.
+    '''
+    def __init__(self, truncate: bool = True, rebin_factor: int = 1, smooth_width: int = 1,
+                 dead_threshold: float = None, dead: list[int] = None) -> None:
+        self.truncate = truncate
+        self.rebin_factor = rebin_factor
+        self.smooth_width = smooth_width
+
+        self.dead_threshold = dead_threshold
+        self.dead = dead or []
+
+    def dead_mask(self, spectra: np.ndarray) -> np.ndarray:
+        if self.dead_threshold is None:
+            mask = np.zeros(spectra.shape, dtype=np.bool_)
+        else:
+            mask = dead_channels(spectra, self.dead_threshold)
+
+        dead = [channel for channel in self.dead if 0 < channel < spectra.shape[-1] - 1]
+        mask[..., dead] = True
+        return mask
+
+    def apply(self, spectrum: np.ndarray) -> np.ndarray:
+        return self.apply_batch([spectrum])[0]
+
+    def apply_batch(self, spectres: list[np.ndarray]) -> list[np.ndarray]:
+        stacked, lengths = stack(spectres)
+        mask = self.dead_mask(stacked)
+        mask &= np.arange(stacked.shape[1])[np.newaxis, :] < lengths[:, np.newaxis] - 1
+
+        stacked = mask_channels(stacked, mask)
+        cutoffs = zero_run_cutoff(stacked, lengths) if self.truncate else lengths
+
+        valid = np.arange(stacked.shape[1])[np.newaxis, :] < lengths[:, np.newaxis]
+        stacked = smooth(stacked, self.smooth_width, valid)
+        stacked = rebin(stacked, self.rebin_factor)
+
+        cutoffs = cutoffs // max(self.rebin_factor, 1)
+        return [stacked[i, :cutoffs[i]] for i in range(len(stacked))]
+
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,128 @@
+from __future__ import annotations
+import numpy as np
+from base import Spectrum, PeakSet
+
+
+COLUMNS = {
+    'run': np.int64,
+    'angle': np.float64,
+    'state': np.float64,
+    'mu': np.float64,
+    'fwhm': np.float64,
+    'area': np.float64,
+    'mu_error': np.float64,
+    'fwhm_error': np.float64,
+    'area_error': np.float64,
+}
+
+
+class ResultsTable:
+    '''
+    Peaks of all analyzed spectres kept in contiguous column arrays:
+    run, angle, state, mu, fwhm, area and their errors.
+    Unknown values (state of unassigned peak, missing errors) are NaN.
+    '''
+    def __init__(self, columns: dict[str, np.ndarray] = None) -> None:
+        columns = columns or {}
+        self.columns = {
+            name: np.ascontiguousarray(columns.get(name, np.empty(0)), dtype=dtype)
+            for name, dtype in COLUMNS.items()
+        }
+
+        lengths = {len(column) for column in self.columns.values()}
+        if len(lengths) > 1:
+            raise ValueError('All columns of results table must have the same length.')
+
+    def __len__(self) -> int:
+        return len(self.columns['angle'])
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        if name in COLUMNS:
+            return self.columns[name]
+        raise AttributeError(name)
+
+    @staticmethod
+    def from_spectres(spectres: list[Spectrum], run: int = 0) -> ResultsTable:
+        sets = [spectrum.peak_set for spectrum in spectres]
+        peaks = PeakSet.concatenate(sets)
+
+        columns = {
+            'run': np.full(len(peaks), run),
+            'angle': np.repeat([spectrum.angle for spectrum in spectres], [len(each) for each in sets]),
+            'state': peaks.states,
+            'mu': peaks.mus,
+            'fwhm': peaks.fwhms,
+            'area': peaks.areas,
+        }
+        for name in ['mu_error', 'fwhm_error', 'area_error']:
+            columns[name] = getattr(peaks, name + 's')
+
+        return ResultsTable(columns)
+
+    @staticmethod
+    def concatenate(tables: list[ResultsTable]) -> ResultsTable:
+        if len(tables) == 0:
+            return ResultsTable()
+        return ResultsTable({name: np.concatenate([table[name] for table in tables]) for name in COLUMNS})
+
+    def take(self, selection: np.ndarray) -> ResultsTable:
+        '''
+        Rows chosen by boolean mask or indexes.
+        '''
+        return ResultsTable({name: column[selection] for name, column in self.columns.items()})
+
+    def where(self, **conditions) -> ResultsTable:
+        '''
+        Filters rows by column equalities, e.g. where(state=0.0, run=1).
+        Value can also be (low, high) tuple for inclusive range.
+        '''
+        mask = np.ones(len(self), dtype=np.bool_)
+        for name, value in conditions.items():
+            column = self.columns[name]
+            if isinstance(value, tuple):
+                mask &= (column >= value[0]) & (column <= value[1])
+            else:
+                mask &= np.isclose(column, value)
+
+        return self.take(mask)
+
+    def group_by(self, name: str) -> dict[float, ResultsTable]:
+        '''
+        Splits table by unique values of column with one stable sort.
+        '''
+        order = np.argsort(self.columns[name], kind='stable')
+        ordered = self.columns[name][order]
+        keys, starts = np.unique(ordered, return_index=True)
+        bounds = np.append(starts, len(ordered))
+
+        return {
+            key.item(): self.take(order[bounds[i]: bounds[i + 1]])
+            for i, key in enumerate(keys)
+        }
+
+    def pivot(self, value: str = 'area', rows: str = 'state', columns: str = 'angle') -> tuple:
+        '''
+        (rows x columns) matrix of value, e.g. areas of states by angles.
+        Returns row keys, column keys and matrix (NaN where no peak).
+        '''
+        row_keys, row_indexes = np.unique(self.columns[rows], return_inverse=True)
+        column_keys, column_indexes = np.unique(self.columns[columns], return_inverse=True)
+
+        matrix = np.full((len(row_keys), len(column_keys)), np.nan)
+        matrix[row_indexes, column_indexes] = self.columns[value]
+        return (row_keys, column_keys, matrix)
+
+    def save(self, path: str) -> None:
+        np.savez(path, **self.columns)
+
+    @staticmethod
+    def load(path: str) -> ResultsTable:
+        with np.load(path) as archive:
+            return ResultsTable({name: archive[name] for name in archive.files})
+
+
+if __name__ == '__main__':
+    pass
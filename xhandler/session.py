@@ -0,0 +1,219 @@
+from __future__ import annotations
+import sys, shlex
+from concurrent.futures import ThreadPoolExecutor, Future
+
+import numpy as np
+
+from analysis import Analytics, PeakSupervisor
+from calibration import CalibrationResult
+from workbook import WorkbookMaster
+from shunting_yard import ReactionMaster, Reaction
+from spectra import Sleuth
+from cache import AnalyticsCache
+
+
+class Session:
+    '''
+    Programmatic analysis session over one directory of spectres.\n
+    Every command returns Future at once and is executed on single worker,
+    so commands run strictly in order of calls and script does not wait:\n
+    session.open(30); session.calibrate('auto'); session.fit(); session.save()\n
+    When observer is given, drawing requests are posted to it
+    (see Observer.post), otherwise session works without any GUI.
+    '''
+    def __init__(self, path: str, reaction: Reaction, observer=None,
+                 cache: AnalyticsCache = None, workbooker: WorkbookMaster = None) -> None:
+        self.sleuth = Sleuth(path)
+        self.reaction = reaction
+        self.observer = observer
+        self.cache = AnalyticsCache() if cache is None else cache
+        self.workbooker = WorkbookMaster(path) if workbooker is None else workbooker
+
+        self.analytics: Analytics = None
+        self.last_saved: float = None
+        self.pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='session')
+
+    def __enter__(self) -> Session:
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.shutdown()
+
+    @property
+    def is_opened(self) -> bool:
+        return self.analytics is not None
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.pool.shutdown(wait=wait)
+
+    def submit(self, command, *args) -> Future:
+        return self.pool.submit(command, *args)
+
+    def __draw(self, name: str, *args) -> None:
+        if self.observer is not None:
+            self.observer.post(getattr(self.observer, name), *args)
+
+    def __opened(self) -> Analytics:
+        if self.analytics is None:
+            raise RuntimeError('First open the spectrum.')
+        return self.analytics
+
+    def open(self, angle: float) -> Future:
+        '''
+        Future of Analytics of angle. Analyzed angles are taken from cache.
+        '''
+        return self.submit(self.__open, float(angle))
+
+    def __open(self, angle: float) -> Analytics:
+        if angle in self.cache:
+            self.analytics = self.cache.get(angle)
+        else:
+            self.analytics = Analytics(self.sleuth.to_spectrum(angle), self.reaction, angle)
+
+        if self.analytics.is_calibrated:
+            self.__draw('draw_calibrated_spectrum', self.analytics.spectrum, self.analytics.energy_view())
+        else:
+            self.__draw('draw_uncalibrated_spectrum', self.analytics.spectrum)
+        self.__draw('draw_peaks', list(self.analytics.peaks))
+
+        return self.analytics
+
+    def calibrate(self, anchors: tuple[int, int] | str = 'auto', **options) -> Future:
+        '''
+        Anchors are two channels of the two first theory peaks or 'auto'.
+        Options go to Analytics.auto_calibrate. Future of (scale value,
+        scale shift) for anchors, of CalibrationResult for 'auto'.
+        '''
+        if anchors != 'auto' and len(anchors) != 2:
+            raise ValueError(f'Calibration needs exactly 2 anchor channels, {len(anchors)} given.')
+        return self.submit(self.__calibrate, anchors, options)
+
+    def __calibrate(self, anchors: tuple[int, int] | str, options: dict) -> tuple[float, float] | CalibrationResult:
+        analytics = self.__opened()
+        if anchors == 'auto':
+            result = analytics.auto_calibrate(**options)
+        else:
+            result = analytics.calibrate(tuple(int(anchor) for anchor in anchors))
+
+        self.__draw('draw_calibrated_spectrum', analytics.spectrum, analytics.energy_view())
+        indexes, states = analytics.theory_channels()
+        self.__draw('scat_dots', np.array(analytics.theory_peaks)[states], analytics.spectrum[indexes])
+
+        return result
+
+    def fit(self, auto: bool = False) -> Future:
+        '''
+        Future of list of fitted PeakSupervisor.
+        '''
+        return self.submit(self.__fit, auto)
+
+    def __fit(self, auto: bool) -> list[PeakSupervisor]:
+        analytics = self.__opened()
+        if not analytics.is_calibrated:
+            raise RuntimeError('Spectrum must be calibrated first.')
+
+        peaks = analytics.create_peaks(auto)
+        self.__draw('draw_peaks', list(peaks))
+        return peaks
+
+    def save(self) -> Future:
+        '''
+        Puts opened analysis into cache and closes it. Future of its angle.
+        '''
+        return self.submit(self.__save)
+
+    def __save(self) -> float:
+        analytics = self.__opened()
+        self.cache.put(analytics)
+        self.analytics = None
+        self.last_saved = analytics.angle
+        return analytics.angle
+
+    def close(self) -> Future:
+        '''
+        Closes opened analysis without saving.
+        '''
+        return self.submit(self.__close)
+
+    def __close(self) -> None:
+        self.analytics = None
+        self.__draw('clear_all_stuff')
+
+    def write(self, angle: float = None) -> Future:
+        '''
+        Writes saved analysis of angle (last saved by default) to workbook.
+        Future of written report.
+        '''
+        return self.submit(self.__write, angle)
+
+    def __write(self, angle: float | None) -> str:
+        angle = self.last_saved if angle is None else angle
+        if angle is None or float(angle) not in self.cache:
+            raise KeyError(f'{angle} angle spectrum was not analyzed.')
+
+        analyzed = self.cache.get(float(angle))
+        report = str(analyzed)
+        self.workbooker.write(report + '\n\n')
+        self.workbooker.record(analyzed)
+        return report
+
+    def execute(self, line: str) -> Future | None:
+        '''
+        Runs one script line, e.g. `open 30`, `calibrate auto`,
+        `calibrate 120 450`, `fit`, `fit auto`, `save`, `write 30`, `close`.
+        Empty lines and # comments give None.
+        '''
+        words = shlex.split(line, comments=True)
+        if len(words) == 0:
+            return None
+
+        command, args = words[0].lower(), words[1:]
+        match command:
+            case 'open': return self.open(float(args[0]))
+            case 'calibrate': return self.calibrate('auto' if not args or args[0] == 'auto' else args)
+            case 'fit': return self.fit(len(args) > 0 and args[0] == 'auto')
+            case 'save': return self.save()
+            case 'write': return self.write(float(args[0]) if args else None)
+            case 'close': return self.close()
+            case _: raise ValueError(f'Unknown session command: {command}')
+
+    def replay(self, lines: list[str]) -> list[tuple[str, Future]]:
+        '''
+        Queues all commands of script at once, returns them with futures.
+        '''
+        return [(line.strip(), future) for line in lines if (future := self.execute(line)) is not None]
+
+    def replay_file(self, path: str) -> list[tuple[str, Future]]:
+        with open(path, 'r') as file:
+            return self.replay(file.readlines())
+
+
+def report(commands: list[tuple[str, Future]]) -> bool:
+    '''
+    Waits for commands and prints their outcome. True if all succeeded.
+    '''
+    is_succeeded = True
+    for line, future in commands:
+        error = future.exception()
+        if error is not None:
+            is_succeeded = False
+            print(f'{line}: {type(error).__name__}: {error}')
+        else:
+            print(f'{line}: done')
+
+    return is_succeeded
+
+
+if __name__ == '__main__':
+    relativistic = '--relativistic' in sys.argv
+    argv = [arg for arg in sys.argv if arg != '--relativistic']
+
+    if len(argv) < 5:
+        print('Usage: session.py [--relativistic] REACTION ENERGY DIRECTORY SCRIPT')
+        sys.exit(1)
+
+    reaction = ReactionMaster(argv[1], float(argv[2])).to_reaction(relativistic)
+    with Session(argv[3], reaction) as session:
+        is_succeeded = report(session.replay_file(argv[4]))
+
+    sys.exit(0 if is_succeeded else 2)
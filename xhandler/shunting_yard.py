@@ -1,6 +1,28 @@
+import re
 from enum import Enum
 from physics import Reaction, Nuclei
 from ensdf import NAME2CHARGE
+from informer import LRUCache
+
+
+PARTICLES = {
+    'p': (1, 1), 'n': (0, 1), 'd': (1, 2), 't': (1, 3),
+    'h': (2, 3), 'a': (2, 4), 'α': (2, 4), 'alpha': (2, 4)
+}
+
+ENERGY_UNITS = {'kev': 1e-3, 'mev': 1.0, 'gev': 1e3}
+
+TOKEN = re.compile(r'''
+    \s*(?:
+        (?P<arrow>->|→)
+      | (?P<symbol>[(),+@])
+      | (?P<energy>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?\s*(?P<unit>[kKmMgG][eE][vV])\b)
+      | (?P<nuclide>(?:\d+[A-Za-z]+|[A-Za-z]+(?:-?\d+)?|α)'*)
+      | (?P<number>\d+(?:\.\d*)?(?:[eE][-+]?\d+)?)
+    )
+''', re.VERBOSE)
+
+PARSE_CACHE = LRUCache(1024)
 
 
 class ReactionNotation(Enum):
@@ -9,94 +31,204 @@ class ReactionNotation(Enum):
     UNDEFINED = 3
 
 
+class ParsedReaction:
+    '''
+    Result of reaction parsing: (charge, nuclons) of every participant
+    and beam energy in MeV (None if string has no energy).
+    Shared by parse cache, so it must not be changed.
+    '''
+    __slots__ = ('notation', 'beam', 'target', 'fragment', 'residual', 'energy')
+
+    def __init__(self, notation: ReactionNotation, beam: tuple[int, int], target: tuple[int, int],
+                 fragment: tuple[int, int], residual: tuple[int, int], energy: float | None) -> None:
+        self.notation = notation
+        self.beam = beam
+        self.target = target
+        self.fragment = fragment
+        self.residual = residual
+        self.energy = energy
+
+
+def tokenize(input: str) -> list[tuple[str, str]]:
+    '''
+    Splits reaction string into (kind, text) tokens. Kinds are
+    arrow, symbol, energy (number with unit), nuclide and number.
+    '''
+    tokens = []
+    position = 0
+    input = input.rstrip()
+
+    while position < len(input):
+        match = TOKEN.match(input, position)
+        if match is None or match.end() == position:
+            raise ValueError(f'Reaction was written incorrectly: unexpected "{input[position:]}".')
+
+        kind = match.lastgroup if match.lastgroup != 'unit' else 'energy'
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+
+    return tokens
+
+
+def nuclide_from_name(name: str) -> tuple[int, int]:
+    '''
+    (charge, nuclons) of particle or nuclide name: p, n, d, t, h (3He),
+    a or α (4He), and isotopes as 7Li, Li7 or Li-7 in any case.
+    Primes of inelastic scattering (p') are ignored.
+    '''
+    lowered = name.lower().rstrip("'")
+    if lowered in PARTICLES:
+        return PARTICLES[lowered]
+
+    match = re.fullmatch(r'(\d+)([a-z]+)|([a-z]+)-?(\d+)', lowered)
+    if match is None:
+        raise ValueError(f'Cannot recognize nuclei "{name}", mass number is required for elements.')
+
+    element = match.group(2) or match.group(3)
+    nuclons = int(match.group(1) or match.group(4))
+    if element not in NAME2CHARGE:
+        raise ValueError(f'Unknown chemical element "{element}" in "{name}".')
+
+    charge = NAME2CHARGE[element]
+    if nuclons < charge or nuclons == 0:
+        raise ValueError(f'Nuclei "{name}" has less nuclons than protons.')
+
+    return (charge, nuclons)
+
+
+def parse_reaction(input: str) -> ParsedReaction:
+    '''
+    Parses reaction in one of 2 notations, optionally followed by energy:\n
+    A(B, C)D - sovetian variant, residual D can be omitted.\n
+    A + B -> D + C - chemistry variant.\n
+    Energy is number with unit (14.5 MeV, 800keV) or bare number in MeV,
+    optionally after @. Results are memoized by string.
+    '''
+    return PARSE_CACHE.get(('reaction', input), lambda: Parser(tokenize(input)).reaction())
+
+
+class Parser:
+    '''
+    Recursive descent parser over tokens of one reaction string.
+    '''
+    def __init__(self, tokens: list[tuple[str, str]]) -> None:
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self) -> tuple[str, str] | None:
+        return self.tokens[self.position] if self.position < len(self.tokens) else None
+
+    def take(self, kind: str, text: str = None) -> str:
+        token = self.peek()
+        if token is None or token[0] != kind or (text is not None and token[1] != text):
+            expected = text if text is not None else kind
+            found = 'end of reaction' if token is None else f'"{token[1]}"'
+            raise ValueError(f'Reaction was written incorrectly: expected {expected}, found {found}.')
+
+        self.position += 1
+        return token[1]
+
+    def is_next(self, kind: str, text: str = None) -> bool:
+        token = self.peek()
+        return token is not None and token[0] == kind and (text is None or token[1] == text)
+
+    def nuclide(self) -> tuple[int, int]:
+        return nuclide_from_name(self.take('nuclide'))
+
+    def reaction(self) -> ParsedReaction:
+        first = self.nuclide()
+
+        if self.is_next('symbol', '('):
+            notation = ReactionNotation.SOVETIAN
+            target = first
+            self.take('symbol', '(')
+            beam = self.nuclide()
+            self.take('symbol', ',')
+            fragment = self.nuclide()
+            self.take('symbol', ')')
+            residual = self.nuclide() if self.is_next('nuclide') else None
+        else:
+            notation = ReactionNotation.CHEMIST
+            target = first
+            self.take('symbol', '+')
+            beam = self.nuclide()
+            self.take('arrow')
+            residual = self.nuclide()
+            self.take('symbol', '+')
+            fragment = self.nuclide()
+
+        energy = self.energy()
+        if self.peek() is not None:
+            raise ValueError(f'Reaction was written incorrectly: unexpected "{self.peek()[1]}".')
+
+        conserved = (beam[0] + target[0] - fragment[0], beam[1] + target[1] - fragment[1])
+        if conserved[0] < 0 or conserved[1] <= 0 or conserved[1] < conserved[0]:
+            raise ValueError('Reaction does not conserve charge and nuclons.')
+        if residual is not None and residual != conserved:
+            raise ValueError('Reaction does not conserve charge and nuclons.')
+
+        return ParsedReaction(notation, beam, target, fragment, conserved, energy)
+
+    def energy(self) -> float | None:
+        if self.is_next('symbol', '@'):
+            self.take('symbol', '@')
+            if not self.is_next('number'):
+                return Parser.energy_value(self.take('energy'))
+
+        if self.is_next('number'):
+            return float(self.take('number'))
+
+        if self.is_next('energy'):
+            return Parser.energy_value(self.take('energy'))
+
+        return None
+
+    @staticmethod
+    def energy_value(text: str) -> float:
+        number, unit = text[:-3].strip(), text[-3:].lower()
+        return float(number) * ENERGY_UNITS[unit]
+
+
 class ReactionMaster:
-    def __init__(self, input: str, energy: float) -> None:
+    def __init__(self, input: str, energy: float = None) -> None:
         '''
         Nuclear reactions can wroted in 2 different styles:
         A(B, C)D - sovetian variant.
         A + B -> C + D - chemistry variant.
+        Beam energy can be given in string, e.g. 7Li(d, t) @ 14.5 MeV,
+        energy argument takes precedence over it.
         '''
         self.reaction = input
-        self.energy = energy
-
-        self.notation = self.__define_notation()
+        self.parsed = parse_reaction(input)
 
-    def __define_notation(self) -> ReactionNotation:
-        if '(' in self.reaction and ')' in self.reaction:
-            return ReactionNotation.SOVETIAN
-        
-        if '->' in self.reaction:
-            return ReactionNotation.CHEMIST
-        
-        return ReactionNotation.UNDEFINED
+        self.energy = energy if energy is not None else self.parsed.energy
+        self.notation = self.parsed.notation
 
-    def to_reaction(self) -> Reaction:
-        nucleus = self.split_nucleus()
-
-        beam = self.to_nuclei(nucleus[0])
-        target = self.to_nuclei(nucleus[1])
-        fragment = self.to_nuclei(nucleus[2])
+    def to_reaction(self, relativistic: bool = False) -> Reaction:
+        '''
+        Reaction with relativistic or classic kinematics (see Reaction).
+        '''
+        if self.energy is None:
+            raise ValueError('Beam energy is not given.')
 
-        return Reaction(beam, target, fragment, self.energy)
+        return Reaction(
+            Nuclei(*self.parsed.beam),
+            Nuclei(*self.parsed.target),
+            Nuclei(*self.parsed.fragment),
+            self.energy,
+            relativistic
+        )
 
     def to_nuclei(self, name: str) -> Nuclei:
-        nuclons = ReactionMaster.nuclons_from_name(name)
-        charge = ReactionMaster.charge_from_name(name)
-        return Nuclei(charge, nuclons)
-
-    def split_nucleus(self) -> list[str]:
-        no_spaces = self.reaction.replace(' ', '')
-
-        if self.notation == ReactionNotation.UNDEFINED:
-            raise ValueError('Reaction was written incorrectly.')
-
-        if self.notation == ReactionNotation.SOVETIAN:
-            return ReactionMaster.split_sovetian(no_spaces)
-
-        if self.notation == ReactionNotation.CHEMIST:
-            return ReactionMaster.split_chemistry(no_spaces)
-    
-    @staticmethod
-    def split_sovetian(input: str) -> list[str]:
-        halfs = input.split(',')
-
-        first_half = halfs[0].split('(')
-        second_half = halfs[1].split(')')
-
-        beam, target = first_half[1], first_half[0]
-        fragment, residual = second_half[0], second_half[1]
-
-        return [beam, target, fragment, residual]
-    
-    @staticmethod
-    def split_chemistry(input: str) -> list[str]:
-        halfs = input.split('->')
-
-        first_half = halfs[0].split('+')
-        second_half = halfs[1].split('+')
-
-        beam, target = first_half[1], first_half[0]
-        fragment, residual = second_half[1], second_half[0]
-
-        return [beam, target, fragment, residual]
+        return Nuclei(*nuclide_from_name(name))
 
     @staticmethod
     def nuclons_from_name(name: str) -> int:
-        name = name.lower()
-        if name in ['p', 'd', 't']:
-            return ['p', 'd', 't'].index(name) + 1
-
-        pretend = ''
-        for i in name:
-            if i.isdigit():
-                pretend += i
-
-        return int(pretend)
+        return nuclide_from_name(name)[1]
 
     @staticmethod
     def charge_from_name(name: str) -> int:
-        name = ''.join([char.lower() for char in name if char.isalpha()])
-        return NAME2CHARGE[name]
+        return nuclide_from_name(name)[0]
 
 
 if __name__ == '__main__':
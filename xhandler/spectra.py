@@ -0,0 +1,102 @@
+import os
+import numpy as np
+
+
+CACHE_DIRECTORY = '.xhandler_cache'
+
+
+def parse_text(path: str) -> np.ndarray:
+    '''
+    Fast path for ASCII channel files with one count per line.
+    Files with several columns or comments are left to np.loadtxt.
+    '''
+    content = open(path, 'r').read()
+
+    first_line = content.lstrip().split('\n', 1)[0]
+    if len(first_line.split()) != 1 or '#' in content:
+        return np.loadtxt(path)
+
+    lines = content.count('\n') + (0 if content.endswith('\n') else 1)
+    try:
+        spectrum = np.array(content.split(), dtype=np.float64)
+    except ValueError:
+        return np.loadtxt(path)
+
+    if len(spectrum) != lines:
+        return np.loadtxt(path)
+
+    return spectrum
+
+
+def cache_path(path: str) -> str:
+    '''
+    Sidecar file of spectrum keyed by modification time and size of source.
+    '''
+    stat = os.stat(path)
+    directory, name = os.path.split(path)
+    return os.path.join(directory, CACHE_DIRECTORY, f'{name}.{stat.st_mtime_ns}.{stat.st_size}.npy')
+
+
+def load_spectrum(path: str) -> np.ndarray:
+    '''
+    Loads spectrum through binary sidecar cache. Sidecar is opened
+    memory-mapped (copy-on-write) and rewritten when the source
+    file changes. Without writable directory falls back to parsing.
+    '''
+    sidecar = cache_path(path)
+    if os.path.exists(sidecar):
+        try:
+            return np.load(sidecar, mmap_mode='c')
+        except (OSError, ValueError):
+            pass
+
+    spectrum = parse_text(path)
+
+    try:
+        store(sidecar, spectrum)
+    except OSError:
+        pass
+
+    return spectrum
+
+
+def store(sidecar: str, spectrum: np.ndarray) -> None:
+    directory, name = os.path.split(sidecar)
+    source_name = name.rsplit('.', 3)[0]
+    os.makedirs(directory, exist_ok=True)
+
+    for stale in os.listdir(directory):
+        if stale != name and stale.rsplit('.', 3)[0] == source_name:
+            os.remove(os.path.join(directory, stale))
+
+    temporary = sidecar + '.tmp'
+    with open(temporary, 'wb') as file:
+        np.save(file, spectrum)
+    os.replace(temporary, sidecar)
+
+
+class Sleuth:
+    def __init__(self, directory: str) -> None:
+        self.dir = directory
+        self.angles = self.get_angles_list()
+
+    def get_angles_list(self) -> list[float]:
+        files = self.only_files(os.listdir(self.dir))
+        return [self.angle_from_name(file) for file in files]
+
+    def angle_from_name(self, file: str) -> float:
+        return float(file.split('.')[0])
+
+    def only_files(self, dirs: list[str]) -> list[str]:
+        return [direc for direc in dirs if '.' in direc and not direc.startswith('.')
+                and os.path.isfile(os.path.join(self.dir, direc))]
+
+    def spectrum_path(self, angle: float) -> str:
+        return os.path.join(self.dir, f'{int(angle)}.txt')
+
+    def to_spectrum(self, angle: float) -> np.ndarray:
+        return load_spectrum(self.spectrum_path(angle))
+
+
+if __name__ == '__main__':
+    pass
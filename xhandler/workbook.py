@@ -1,10 +1,158 @@
-import os
+import os, json
+import threading
 import numpy as np
 
-from analysis import *
+from base import Spectrum, Peak, PeakSet
+from analysis import Analytics
+from results import ResultsTable
+
+
+TEXT_WORKBOOK = 'workbook.txt'
+STORE_WORKBOOK = 'workbook.jsonl'
+
+
+def nullable(value: float | None) -> float | None:
+    '''
+    NaN is not valid JSON, unknown values are written as null
+    and read back as NaN (see from_record).
+    '''
+    return None if value is None or np.isnan(value) else value
+
+
+def to_record(spectrum: Spectrum) -> dict:
+    peaks = spectrum.peak_set
+    errors = np.column_stack((peaks.mu_errors, peaks.fwhm_errors, peaks.area_errors))
+    errors = [None if np.isnan(row).all() else [nullable(value) for value in row] for row in errors.tolist()]
+    return {
+        'angle': spectrum.angle,
+        'scale_value': spectrum.scale_value,
+        'scale_shift': spectrum.scale_shift,
+        'scale_square': spectrum.scale_square,
+        'peaks': [
+            {'state': nullable(state), 'mu': nullable(mu), 'fwhm': nullable(fwhm), 'area': nullable(area),
+             'errors': errors}
+            for state, mu, fwhm, area, errors in zip(
+                peaks.states.tolist(), peaks.mus.tolist(), peaks.fwhms.tolist(), peaks.areas.tolist(), errors
+            )
+        ]
+    }
+
+
+def from_record(record: dict) -> Spectrum:
+    result = Spectrum()
+
+    result.angle = record['angle']
+    if record['scale_value'] > 0:
+        result.scale_value = record['scale_value']
+    result.scale_shift = record['scale_shift']
+    result.scale_square = record.get('scale_square', 0)
+
+    infos = record['peaks']
+    errors = np.array([info.get('errors') or [np.nan] * 3 for info in infos], dtype=np.float64).reshape(-1, 3)
+    result.peaks = PeakSet(
+        [info['mu'] for info in infos],
+        [info['fwhm'] for info in infos],
+        [info['area'] for info in infos],
+        [info.get('state') for info in infos],
+        errors[:, 0], errors[:, 1], errors[:, 2]
+    )
+    return result
+
+
+class WorkbookStore:
+    '''
+    Append-only JSON lines store with one record per analyzed angle.
+    Index keeps byte offset of the latest record of every angle and is
+    extended incrementally, only lines appended since the last scan are read.
+    '''
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+        self.__index: dict[float, int] = {}
+        self.__scanned = 0
+        self.__lock = threading.Lock()
+
+    def __contains__(self, angle: float) -> bool:
+        return angle in self.index
+
+    @property
+    def index(self) -> dict[float, int]:
+        with self.__lock:
+            self.__scan()
+            return self.__index
+
+    @property
+    def angles(self) -> list[float]:
+        return sorted(self.index)
+
+    def __scan(self) -> None:
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.__scanned)
+            while True:
+                offset = file.tell()
+                line = file.readline()
+                if not line.endswith(b'\n'):
+                    break
+
+                angle = WorkbookStore.angle_of(line)
+                if angle is not None:
+                    self.__index[angle] = offset
+                self.__scanned = file.tell()
+
+    @staticmethod
+    def angle_of(line: bytes) -> float | None:
+        '''
+        Records are written with angle as the first key,
+        so it is read without decoding of the whole line.
+        '''
+        prefix = b'{"angle": '
+        if not line.startswith(prefix):
+            return None
+
+        stop = line.index(b',', len(prefix))
+        return float(line[len(prefix): stop])
+
+    def append(self, spectrum: Spectrum) -> None:
+        line = json.dumps(to_record(spectrum), allow_nan=False) + '\n'
+
+        with self.__lock:
+            self.__scan()
+            with open(self.path, 'ab') as file:
+                offset = file.tell()
+                file.write(line.encode())
+
+            self.__index[spectrum.angle] = offset
+            self.__scanned = offset + len(line.encode())
+
+    def get(self, angle: float) -> Spectrum:
+        if angle not in self.index:
+            raise KeyError(f'{angle} angle spectrum is not in workbook.')
+
+        with open(self.path, 'rb') as file:
+            file.seek(self.index[angle])
+            return from_record(json.loads(file.readline()))
+
+    def all(self) -> list[Spectrum]:
+        offsets = sorted(self.index.values())
+        if len(offsets) == 0:
+            return []
+
+        collected = []
+        with open(self.path, 'rb') as file:
+            for offset in offsets:
+                file.seek(offset)
+                collected.append(from_record(json.loads(file.readline())))
+
+        return sorted(collected, key=lambda spectrum: spectrum.angle)
 
 
 class WorkbookParser:
+    '''
+    Reader of legacy free-text workbook, which consists of Analytics reports.
+    '''
     def __init__(self, path: str, spectres_path: str) -> None:
         self.path = path
         self.spectres_path = spectres_path
@@ -12,49 +160,48 @@ class WorkbookParser:
         self.all = None
 
     def find_angle(self, angle: float) -> Spectrum:
+        if self.all is None:
+            self.all = self.collect_all()
         return next(analyzed for analyzed in self.all if analyzed.angle == angle)
 
     def collect_all(self) -> list[Spectrum]:
-        if 'workbook.txt' not in os.listdir(self.path):
+        if TEXT_WORKBOOK not in os.listdir(self.path):
             return []
 
-        all_reports = open(self.path + '\\workbook.txt', 'r').read().split('\n\n')[1:]
-        return [self.reverse_parameters(report) for report in all_reports]
+        all_reports = open(os.path.join(self.path, TEXT_WORKBOOK), 'r').read().split('\n\n')
+        return [self.reverse_parameters(report.strip('\n')) for report in all_reports if report.strip()]
 
     def reverse_parameters(self, report: str) -> Spectrum:
         result = Spectrum()
 
-        result.angle = self.__get_angle()
-        result.scale_value, result.scale_shift = self.__get_calibration_constants(report)
+        result.angle = self.__get_angle(report)
+        result.scale_value, result.scale_shift, result.scale_square = self.__get_calibration_constants(report)
         result.peaks = self.__get_peaks(report)
 
         return result
 
-    def __get_spectrum(self, path: str, angle: float) -> np.ndarray:
-        return np.loadtxt(path + f'{int(angle)}.txt')
-
     def __get_angle(self, report: str) -> float:
         fiducial_index = report.index('angle') - 2
         return float(report[:fiducial_index])
 
-    def __get_calibration_constants(self, report: str) -> tuple[float, float]:
+    def __get_calibration_constants(self, report: str) -> tuple[float, float, float]:
         equation = self.__get_equation(report)
         parts = equation.split(' + ')
 
         scale_shift = float(parts[1])
         scale_value = float(parts[0].split(' * ')[0])
+        scale_square = float(parts[2].split(' * ')[0]) if len(parts) > 2 else 0
 
-        return (scale_value, scale_shift)
+        return (scale_value, scale_shift, scale_square)
 
     def __get_equation(self, report: str) -> str:
         lines = report.split('\n')
         info_str = 'Calibrated by equation: E(ch) = '
 
         position = lines[1].index(info_str) + len(info_str)
-        return lines[1][position + 1:]
+        return lines[1][position:]
 
-    #TODO: Implement this method.
-    def __get_peaks(self, report: str) -> list[PeakSupervisor]:
+    def __get_peaks(self, report: str) -> list[Peak]:
         lines = report.split('\n')
         info_str = 'Peaks analysis info'
 
@@ -62,35 +209,42 @@ class WorkbookParser:
         taken = []
 
         for i in range(peaks_start, len(lines)):
-            pass
+            columns = [column.strip() for column in lines[i].split('\t')]
+            if len(columns) != 4:
+                continue
 
-        return taken
-    
-    # TODO: Implement this method.
-    def __reverse_peak(self, center: float, fwhm: float, calib_coeff: float, calib_e0: float) -> PeakSupervisor:
-        fwtm = fwhm / np.log10(2)
+            state, center, fwhm, area = [float(column) for column in columns]
+            taken.append(self.__reverse_peak(state, center, fwhm, area))
 
-        channel_width = int(fwtm / calib_coeff)
-        center_in_channel = int((center - calib_e0) / calib_coeff)
+        return taken
 
-        spectrum = self.__get_spectrum()
+    def __reverse_peak(self, state: float, center: float, fwhm: float, area: float) -> Peak:
+        peak = Peak()
+        peak.update(center, fwhm, area, state)
+        return peak
 
 
-# TODO: Croutch.
 class WorkbookMaster:
     def __init__(self, spectres_path: str) -> None:
         self.path = os.getcwd()
         self.spectres_path = spectres_path
 
         self.parser = WorkbookParser(self.path, self.spectres_path)
+        self.store = WorkbookStore(os.path.join(self.path, STORE_WORKBOOK))
 
     def write(self, message: str) -> None:
-        file = open(self.path + '\\workbook.txt', 'a')
+        file = open(os.path.join(self.path, TEXT_WORKBOOK), 'a')
         file.write(message)
         file.close()
 
-    def gather_analyzed(self) -> list[Analytics]:
-        return self.parser.all
+    def record(self, analytics: Analytics) -> None:
+        self.store.append(analytics.base)
+
+    def gather_analyzed(self) -> list[Spectrum]:
+        return self.store.all()
+
+    def results(self, run: int = 0) -> ResultsTable:
+        return ResultsTable.from_spectres(self.gather_analyzed(), run)
 
 
 if __name__ == '__main__':